@@ -0,0 +1,110 @@
+"""
+Prueba de carga: latencia de un endpoint ajeno al login mientras llega una ráfaga de logins.
+
+Lanza `--logins` peticiones a /login/ a la vez y, durante la ráfaga, mide la latencia de
+GET /clasificaciones/ (autenticado con un token ya en caché). Con --bloqueante se verifica
+la contraseña dentro del bucle de eventos, como antes, para comparar.
+
+Usa una base de datos SQLite temporal (necesita aiosqlite y httpx).
+Uso (desde backend/): python -m benchmarks.bench_login_storm [--logins N] [--bloqueante]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+import httpx
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+import main
+from users import models, security
+
+
+def percentil(valores, p):
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(len(valores) * p / 100))]
+
+
+async def medir_latencias(client, headers, parar, intervalo=0.01):
+    latencias = []
+    while not parar.is_set():
+        inicio = time.perf_counter()
+        respuesta = await client.get("/clasificaciones/", headers=headers)
+        respuesta.raise_for_status()
+        latencias.append((time.perf_counter() - inicio) * 1000)
+        await asyncio.sleep(intervalo)
+    return latencias
+
+
+async def ejecutar(num_logins, duracion_base):
+    directorio = tempfile.mkdtemp()
+    engine = create_async_engine(f"sqlite+aiosqlite:///{os.path.join(directorio, 'bench.db')}")
+    sesiones = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+    async with engine.begin() as conn:
+        await conn.run_sync(models.Base.metadata.create_all)
+    async with sesiones() as db:
+        db.add(models.User(name="bench", email="bench@example.com", hashed_password=security.hash_password("secreto")))
+        await db.commit()
+
+    async def get_db():
+        async with sesiones() as session:
+            yield session
+
+    main.app.dependency_overrides[main.get_db] = get_db
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        headers = {"Authorization": f"Bearer {security.create_access_token({'sub': 'bench'})}"}
+        await client.get("/clasificaciones/", headers=headers)  # Deja el token en caché
+
+        # Latencia sin carga
+        parar = asyncio.Event()
+        tarea = asyncio.create_task(medir_latencias(client, headers, parar))
+        await asyncio.sleep(duracion_base)
+        parar.set()
+        base = await tarea
+
+        # Latencia durante la ráfaga de logins
+        parar = asyncio.Event()
+        tarea = asyncio.create_task(medir_latencias(client, headers, parar))
+        inicio = time.perf_counter()
+        respuestas = await asyncio.gather(*(
+            client.post("/login/", data={"username": "bench", "password": "secreto"}) for _ in range(num_logins)
+        ))
+        duracion = time.perf_counter() - inicio
+        parar.set()
+        durante = await tarea
+
+    await engine.dispose()
+    codigos = {}
+    for respuesta in respuestas:
+        codigos[respuesta.status_code] = codigos.get(respuesta.status_code, 0) + 1
+    return base, durante, codigos, duracion
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=50)
+    parser.add_argument("--duracion-base", type=float, default=1.0)
+    parser.add_argument("--bloqueante", action="store_true", help="verificar bcrypt dentro del bucle de eventos")
+    args = parser.parse_args()
+
+    if args.bloqueante:
+        async def verify_en_el_bucle(plain_password, hashed_password):
+            return security.verify_password(plain_password, hashed_password)
+        security.verify_password_async = verify_en_el_bucle
+
+    base, durante, codigos, duracion = asyncio.run(ejecutar(args.logins, args.duracion_base))
+    print(f"logins: {args.logins} en {duracion:.2f}s, respuestas por código: {codigos}")
+    for nombre, latencias in (("sin carga", base), ("durante ráfaga", durante)):
+        if not latencias:
+            print(f"{nombre:15} sin muestras (el bucle de eventos estuvo bloqueado)")
+            continue
+        print(f"{nombre:15} n={len(latencias):4}  p50={statistics.median(latencias):7.1f} ms  "
+              f"p99={percentil(latencias, 99):7.1f} ms  max={max(latencias):7.1f} ms")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,114 @@
+"""
+Micro-benchmark del parser de tickets: compara parse_ticket con la versión anterior,
+que hacía hasta cuatro operaciones con expresiones sin compilar por línea.
+
+Antes de medir comprueba que parse_ticket devuelve exactamente los productos del corpus
+(unidades, descripción e importe, también con productos a peso y nombres partidos) y sale
+con código 1 si no es así.
+
+Uso (desde backend/): python -m benchmarks.bench_parser [--tickets N] [--repeticiones N]
+"""
+import argparse
+import random
+import re
+import sys
+import time
+
+import pandas as pd
+
+from benchmarks.corpus import ticket_corpus, ticket_text
+from pdf_processor import parse_ticket
+
+
+def parse_ticket_anterior(text):
+    """Copia del parser anterior, solo para comparar."""
+    lines = text.split("\n")
+    productos = []
+    fecha, hora = None, None
+    procesando_productos = False
+    for line in lines:
+        if re.search(r"\d{2}/\d{2}/\d{4} \d{2}:\d{2}", line):
+            fecha_hora = re.search(r"(\d{2}/\d{2}/\d{4}) (\d{2}:\d{2})", line)
+            if fecha_hora:
+                fecha = fecha_hora.group(1)
+                hora = fecha_hora.group(2)
+            continue
+        if "Descripción P. Unit Importe" in line:
+            procesando_productos = True
+            continue
+        if "TOTAL" in line:
+            procesando_productos = False
+            break
+        if procesando_productos:
+            match = re.findall(r"(\d+,\d{2})", line)
+            if len(match) >= 1:
+                importe = match[-1].replace(",", ".")
+                p_unit = match[-2].replace(",", ".") if len(match) >= 2 else None
+                num_articulos = re.match(r"(\d+)", line).group(1)
+                descripcion = re.sub(r"^\d+\s*", "", line).rsplit(match[-1], 1)[0].strip()
+                try:
+                    productos.append((int(num_articulos), descripcion, float(p_unit) if p_unit else None,
+                                      float(importe), fecha, hora))
+                except ValueError:
+                    continue
+    return pd.DataFrame(productos, columns=["Número de artículos", "Descripción", "P. Unit", "Importe", "Fecha", "Hora"])
+
+
+def comprobar(num_tickets, seed=0):
+    """
+    Comparar las filas de parse_ticket con los productos con los que se generó cada ticket.
+    Devuelve la lista de diferencias (vacía si todo coincide).
+    """
+    rng = random.Random(seed)
+    diferencias = []
+    for i in range(num_tickets):
+        esperados = []
+        texto = ticket_text(rng.randint(5, 80), rng=rng, productos=esperados)
+        df = parse_ticket(texto)
+        obtenidos = list(zip(df["Número de artículos"], df["Descripción"], df["Importe"]))
+        if obtenidos != esperados:
+            diferencias.append((i, esperados, obtenidos))
+    return diferencias
+
+
+def medir(parser, corpus, repeticiones):
+    """Devuelve las líneas de texto procesadas por segundo (mejor de `repeticiones`)."""
+    num_lineas = sum(text.count("\n") + 1 for text in corpus)
+    mejor = float("inf")
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        for text in corpus:
+            parser(text)
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return num_lineas / mejor
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tickets", type=int, default=500)
+    parser.add_argument("--repeticiones", type=int, default=5)
+    args = parser.parse_args()
+
+    diferencias = comprobar(args.tickets)
+    if diferencias:
+        i, esperados, obtenidos = diferencias[0]
+        fallos = [(e, o) for e, o in zip(esperados, obtenidos) if e != o][:3]
+        print(f"ERROR: parse_ticket no devuelve los productos de {len(diferencias)} de {args.tickets} tickets "
+              f"(ticket {i}: {len(esperados)} productos esperados, {len(obtenidos)} obtenidos; {fallos})", file=sys.stderr)
+        sys.exit(1)
+    print(f"parse_ticket devuelve los productos de los {args.tickets} tickets del corpus")
+
+    # El parser anterior falla con productos a peso y nombres partidos, así que la comparación
+    # se hace con tickets de una línea por producto
+    sencillos = ticket_corpus(args.tickets, pesados=False, partidos=False)
+    anterior = medir(parse_ticket_anterior, sencillos, args.repeticiones)
+    nuevo = medir(parse_ticket, sencillos, args.repeticiones)
+    completos = medir(parse_ticket, ticket_corpus(args.tickets), args.repeticiones)
+
+    print(f"parser anterior:             {anterior:12,.0f} líneas/s")
+    print(f"parse_ticket:                {nuevo:12,.0f} líneas/s  (x{nuevo / anterior:.2f})")
+    print(f"parse_ticket (peso/partidos): {completos:11,.0f} líneas/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""
+Benchmark del pipeline completo de procesamiento de tickets con datos sintéticos.
+
+Mide el rendimiento (unidades por segundo, mejor de `--repeticiones`) y el pico de memoria
+(tracemalloc, en una ejecución aparte para no falsear los tiempos) de:
+  - extract_text_from_pdf   PDFs generados con benchmarks.corpus
+  - process_ticket          parseo y clasificación línea a línea de los textos
+  - clasificar_producto     clasificación de descripciones sueltas
+  - classify_many           clasificación vectorizada de la columna del CSV
+  - calcular_graficos       agregados de los gráficos sobre el CSV
+  - upload_pdfs / upload_csv  el endpoint /upload/ completo con un cliente de pruebas en
+                            proceso (SQLite temporal, caché de tickets desactivada)
+
+El pico de memoria del endpoint de PDFs no incluye los procesos del pool (ver PDF_WORKERS);
+"rss_max_mib" es el máximo de memoria residente de todo el benchmark.
+
+Los resultados se guardan en JSON para comparar ejecuciones:
+  python -m benchmarks.bench_pipeline --salida antes.json
+  python -m benchmarks.bench_pipeline --salida despues.json --comparar antes.json
+
+Uso (desde backend/): python -m benchmarks.bench_pipeline [--pdfs N] [--filas-csv N] [--repeticiones N]
+"""
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+from benchmarks.corpus import ticket_csv, ticket_pdf, ticket_text
+
+
+def medir(funcion, repeticiones):
+    """
+    Devuelve (segundos de la mejor repetición, pico de memoria en MiB de una ejecución aparte).
+    """
+    mejor = float("inf")
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        mejor = min(mejor, time.perf_counter() - inicio)
+    tracemalloc.start()
+    funcion()
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return mejor, pico / 2**20
+
+
+def resultado(segundos, pico_mib, unidades, unidad):
+    return {
+        "segundos": round(segundos, 4),
+        "unidades": unidades,
+        "unidad": unidad,
+        "por_segundo": round(unidades / segundos, 1) if segundos else None,
+        "pico_mib": round(pico_mib, 1),
+    }
+
+
+def preparar_entorno(directorio):
+    # Base de datos y caché propias del benchmark; hay que fijarlas antes de importar main
+    os.environ["DB_SQLITE_PATH"] = os.path.join(directorio, "bench.sqlite3")
+    os.environ["TICKET_CACHE_MAX_MB"] = "0"
+    for variable in ("DATABASE_URL", "DB_USER", "DB_PASSWORD", "DB_HOST", "DB_NAME"):
+        os.environ.pop(variable, None)
+
+
+def medir_funciones(textos, pdfs, csv, repeticiones):
+    from main import calcular_graficos
+    from classifier import get_classifier
+    from pdf_processor import clasificar_producto, extract_text_from_pdf, process_ticket
+
+    resultados = {}
+    num_lineas = sum(len(t.split("\n")) for t in textos)
+
+    segundos, pico = medir(lambda: [extract_text_from_pdf(io.BytesIO(pdf)) for pdf in pdfs], repeticiones)
+    resultados["extract_text_from_pdf"] = resultado(segundos, pico, len(pdfs), "pdfs")
+
+    segundos, pico = medir(lambda: [process_ticket(t) for t in textos], repeticiones)
+    resultados["process_ticket"] = resultado(segundos, pico, num_lineas, "lineas")
+
+    df = pd.read_csv(io.BytesIO(csv), encoding="utf-8")
+    descripciones = df["Descripción"].tolist()
+    segundos, pico = medir(lambda: [clasificar_producto(d) for d in descripciones], repeticiones)
+    resultados["clasificar_producto"] = resultado(segundos, pico, len(descripciones), "descripciones")
+
+    clasificador = get_classifier()
+    segundos, pico = medir(lambda: clasificador.classify_many(df["Descripción"]), repeticiones)
+    resultados["classify_many"] = resultado(segundos, pico, len(df), "filas")
+
+    df["Clasificación"] = clasificador.classify_many(df["Descripción"])
+    segundos, pico = medir(lambda: calcular_graficos(df), repeticiones)
+    resultados["calcular_graficos"] = resultado(segundos, pico, len(df), "filas")
+    return resultados
+
+
+def medir_endpoint(pdfs, csv, repeticiones):
+    from fastapi.testclient import TestClient
+    import main
+
+    resultados = {}
+    with TestClient(main.app) as client:
+        usuarios = iter(range(10**6))
+
+        # Cada subida se hace con un usuario nuevo: al mismo usuario no se le guardan dos
+        # veces los mismos ficheros, y la segunda subida no mediría lo mismo
+        def cabeceras():
+            nombre = f"bench{next(usuarios)}"
+            client.post("/signup/", json={"name": nombre, "email": f"{nombre}@example.com", "password": "secreto"})
+            token = client.post("/login/", data={"username": nombre, "password": "secreto"}).json()["access_token"]
+            return {"Authorization": f"Bearer {token}"}
+
+        def subir(ficheros, headers):
+            respuesta = client.post("/upload/", files=ficheros, headers=headers)
+            respuesta.raise_for_status()
+
+        for nombre, ficheros, unidades, unidad in (
+            ("upload_pdfs", [("files", (f"{i}.pdf", pdf, "application/pdf")) for i, pdf in enumerate(pdfs)], len(pdfs), "pdfs"),
+            ("upload_csv", [("csv", ("tickets.csv", csv, "text/csv"))], csv.count(b"\n") - 1, "filas"),
+        ):
+            lista = [cabeceras() for _ in range(repeticiones + 1)]
+            segundos, pico = medir(lambda: subir(ficheros, lista.pop()), repeticiones)
+            resultados[nombre] = resultado(segundos, pico, unidades, unidad)
+    return resultados
+
+
+def commit_actual():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def comparar(actual, anterior):
+    print(f"\n{'etapa':24} {'antes':>14} {'ahora':>14} {'cambio':>8}")
+    for etapa, datos in actual["resultados"].items():
+        previo = anterior.get("resultados", {}).get(etapa)
+        if not previo or not previo.get("por_segundo") or not datos["por_segundo"]:
+            continue
+        print(f"{etapa:24} {previo['por_segundo']:14,.0f} {datos['por_segundo']:14,.0f} {datos['por_segundo'] / previo['por_segundo']:7.2f}x")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdfs", type=int, default=100, help="tickets en PDF generados")
+    parser.add_argument("--lineas", type=int, nargs=2, default=(5, 80), metavar=("MIN", "MAX"), help="productos por ticket")
+    parser.add_argument("--filas-csv", type=int, default=50_000)
+    parser.add_argument("--repeticiones", type=int, default=3)
+    parser.add_argument("--sin-endpoint", action="store_true", help="no medir /upload/")
+    parser.add_argument("--salida", help="fichero JSON donde guardar los resultados")
+    parser.add_argument("--comparar", help="JSON de una ejecución anterior con la que comparar")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    preparar_entorno(tempfile.mkdtemp(prefix="bench-"))
+    rng = random.Random(args.seed)
+    textos = [ticket_text(rng.randint(*args.lineas), rng=rng) for _ in range(args.pdfs)]
+    pdfs = [ticket_pdf(texto) for texto in textos]
+    csv = ticket_csv(args.filas_csv, seed=args.seed)
+
+    resultados = medir_funciones(textos, pdfs, csv, args.repeticiones)
+    if not args.sin_endpoint:
+        resultados.update(medir_endpoint(pdfs, csv, args.repeticiones))
+
+    informe = {
+        "fecha": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": commit_actual(),
+        "python": sys.version.split()[0],
+        "plataforma": platform.platform(),
+        "cpus": os.cpu_count(),
+        "pdf_workers": os.getenv("PDF_WORKERS"),
+        "parametros": {"pdfs": args.pdfs, "lineas": list(args.lineas), "filas_csv": args.filas_csv,
+                       "repeticiones": args.repeticiones, "seed": args.seed},
+        "resultados": resultados,
+        # ru_maxrss está en KiB en Linux
+        "rss_max_mib": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+    for etapa, datos in resultados.items():
+        print(f"{etapa:24} {datos['por_segundo']:14,.0f} {datos['unidad']}/s  {datos['segundos']:9.3f} s  pico {datos['pico_mib']:8.1f} MiB")
+    print(f"{'rss máximo':24} {informe['rss_max_mib']:14,.1f} MiB")
+
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(informe, f, ensure_ascii=False, indent=2)
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            comparar(informe, json.load(f))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,141 @@
+import random
+
+# Productos de ejemplo con los nombres abreviados y acentuados que usa Mercadona
+PRODUCTOS = [
+    "LECHE ENTERA", "LECHE SEMI S/LACT", "YOG. GRIEGO NATURAL", "YOGUR LÁCTEO FRESA", "QUESO CURADO VIEJO",
+    "PAN DE MOLDE", "CROISSANT MANTEQUILLA", "GALLETA MARÍA", "DONUT CHOCOLATE", "PIZZA 4 QUESOS",
+    "LASAÑA BOLOÑESA", "AGUA MINERAL 1,5L", "ZUMO PIÑA", "CAFÉ MOLIDO NATURAL", "CERVEZA TOSTADA",
+    "VINO TINTO RIOJA", "RON AÑEJO", "TOMATE CHERRY", "LECHUGA ICEBERG", "MANZANA GOLDEN",
+    "ACEITE OLIVA VIRGEN", "HUEVOS CAMPEROS", "JAMÓN SERRANO LONCH", "ATÚN CLARO PACK-3", "PAPEL HIGIÉNICO",
+]
+# Productos que se venden a peso
+PRODUCTOS_PESO = ["PLATANO", "TOMATE PERA", "PATATA", "NARANJA ZUMO", "MANZANA ROJA", "CALABACÍN"]
+
+
+def _importe(valor):
+    return f"{valor:.2f}".replace(".", ",")
+
+
+def _valor(importe):
+    # El importe tal y como queda escrito en el ticket
+    return float(_importe(importe).replace(",", "."))
+
+
+def ticket_text(num_lineas=30, pesados=True, partidos=True, rng=None, productos=None):
+    """
+    Generar el texto de un ticket sintético de Mercadona con `num_lineas` productos.
+    Con `pesados` incluye productos a peso (dos líneas) y con `partidos`, nombres partidos en dos líneas.
+    Si se pasa la lista `productos`, se le añade (unidades, descripción, importe) de cada producto,
+    lo que debería devolver el parser.
+    """
+    esperados = productos if productos is not None else []
+    rng = rng or random.Random()
+    dia, mes, anio = rng.randint(1, 28), rng.randint(1, 12), rng.randint(2021, 2024)
+    lineas = [
+        "MERCADONA, S.A. A-46103834",
+        "C/ SAN FERNANDO 12",
+        "41004 SEVILLA",
+        "TELÉFONO: 954000000",
+        f"{dia:02d}/{mes:02d}/{anio} {rng.randint(9, 21):02d}:{rng.randint(0, 59):02d} OP: {rng.randint(1000, 9999)}",
+        f"FACTURA SIMPLIFICADA: {rng.randint(1000, 9999)}-{rng.randint(100, 999)}-{rng.randint(100000, 999999)}",
+        "Descripción P. Unit Importe",
+    ]
+    total = 0.0
+    for _ in range(num_lineas):
+        tipo = rng.random()
+        if pesados and tipo < 0.1:
+            peso = rng.uniform(0.2, 2.5)
+            precio_kg = rng.uniform(0.8, 4.0)
+            importe = round(peso * precio_kg, 2)
+            nombre = rng.choice(PRODUCTOS_PESO)
+            lineas.append(f"1 {nombre}")
+            lineas.append(f"{peso:.3f} kg {_importe(precio_kg)} €/kg {_importe(importe)}".replace(".", ","))
+            esperados.append((1, nombre, _valor(importe)))
+        elif partidos and tipo < 0.15:
+            nombre = rng.choice(PRODUCTOS)
+            partes = nombre.split(" ", 1)
+            importe = rng.uniform(0.5, 12.0)
+            lineas.append(f"1 {partes[0]}")
+            lineas.append(f"{partes[-1]} {_importe(importe)}")
+            esperados.append((1, nombre, _valor(importe)))
+        else:
+            unidades = rng.choice([1, 1, 1, 2, 3, 6])
+            p_unit = rng.uniform(0.3, 12.0)
+            importe = p_unit * unidades
+            nombre = rng.choice(PRODUCTOS)
+            if unidades > 1:
+                lineas.append(f"{unidades} {nombre} {_importe(p_unit)} {_importe(importe)}")
+            else:
+                lineas.append(f"1 {nombre} {_importe(importe)}")
+            esperados.append((unidades, nombre, _valor(importe)))
+        total += round(importe, 2)
+    lineas += [
+        f"TOTAL (€) {_importe(total)}",
+        f"TARJETA BANCARIA {_importe(total)}",
+        "IVA BASE IMPONIBLE (€) CUOTA (€)",
+        "SE ADMITEN DEVOLUCIONES CON TICKET",
+    ]
+    return "\n".join(lineas)
+
+
+def ticket_corpus(num_tickets=500, num_lineas=(5, 80), pesados=True, partidos=True, seed=0):
+    """
+    Generar una lista de textos de tickets con un número de productos aleatorio en el rango `num_lineas`.
+    """
+    rng = random.Random(seed)
+    return [ticket_text(rng.randint(*num_lineas), pesados, partidos, rng) for _ in range(num_tickets)]
+
+
+def _pdf_texto(texto):
+    return texto.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def ticket_pdf(texto, lineas_por_pagina=60):
+    """
+    Convertir el texto de un ticket en un PDF mínimo (Helvetica, WinAnsi) del que PyPDF2
+    extrae las mismas líneas. Los tickets largos ocupan varias páginas.
+    """
+    lineas = texto.split("\n")
+    paginas = [lineas[i:i + lineas_por_pagina] for i in range(0, len(lineas), lineas_por_pagina)] or [[]]
+    # Objetos: 1 catálogo, 2 páginas, 3 fuente y, por cada página, la página y su contenido
+    objetos = [None, None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>"]
+    hijos = []
+    for pagina in paginas:
+        contenido = ("BT /F1 9 Tf 11 TL 20 800 Td " + " ".join(f"({_pdf_texto(l)}) Tj T*" for l in pagina) + " ET").encode("cp1252")
+        numero = len(objetos) + 1
+        hijos.append(f"{numero} 0 R")
+        objetos.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Contents {numero + 1} 0 R "
+            "/Resources << /Font << /F1 3 0 R >> >> >>".encode()
+        )
+        objetos.append(b"<< /Length %d >>\nstream\n" % len(contenido) + contenido + b"\nendstream")
+    objetos[0] = b"<< /Type /Catalog /Pages 2 0 R >>"
+    objetos[1] = f"<< /Type /Pages /Kids [{' '.join(hijos)}] /Count {len(hijos)} >>".encode()
+
+    salida = b"%PDF-1.4\n"
+    posiciones = []
+    for numero, objeto in enumerate(objetos, 1):
+        posiciones.append(len(salida))
+        salida += b"%d 0 obj\n" % numero + objeto + b"\nendobj\n"
+    xref = len(salida)
+    salida += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objetos) + 1)
+    salida += b"".join(b"%010d 00000 n \n" % posicion for posicion in posiciones)
+    salida += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objetos) + 1, xref)
+    return salida
+
+
+def ticket_csv(num_filas=100_000, seed=0):
+    """
+    Generar un CSV como los que acepta /upload/ con `num_filas` productos.
+    """
+    rng = random.Random(seed)
+    filas = ["Número de artículos,Descripción,P. Unit,Importe,Fecha,Hora"]
+    for _ in range(num_filas):
+        unidades = rng.choice([1, 1, 1, 2, 3])
+        p_unit = round(rng.uniform(0.3, 12.0), 2)
+        descripcion = rng.choice(PRODUCTOS + PRODUCTOS_PESO).replace(",", ".")
+        filas.append(
+            f"{unidades},{descripcion},{p_unit if unidades > 1 else ''},{round(p_unit * unidades, 2)},"
+            f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/{rng.randint(2021, 2024)},{rng.randint(9, 21):02d}:{rng.randint(0, 59):02d}"
+        )
+    return ("\n".join(filas) + "\n").encode("utf-8")
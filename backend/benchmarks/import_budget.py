@@ -0,0 +1,72 @@
+"""
+Presupuesto de tiempo de importación de la API (lo que tarda un worker nuevo en arrancar).
+
+Importa `main` en un proceso limpio con `python -X importtime`, varias veces, y comprueba:
+  - que el mejor tiempo total no pasa de `--presupuesto-ms`;
+  - que no se cargan al importar las librerías pesadas que la API solo necesita al
+    procesar la primera subida o el primer login (pandas, PyPDF2, passlib, jose...).
+
+Muestra además los módulos que más tardan en importarse para localizar regresiones.
+Sale con código 1 si no se cumple el presupuesto, así que sirve como comprobación en CI.
+
+Uso (desde backend/): python -m benchmarks.import_budget [--presupuesto-ms N] [--repeticiones N]
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+# Módulos que no deben importarse al cargar la aplicación
+PEREZOSOS = ("pandas", "numpy", "pyarrow", "PyPDF2", "passlib", "bcrypt", "jose", "aiosqlite", "asyncpg")
+
+
+def medir_importacion(modulo):
+    """
+    Importar `modulo` en un intérprete nuevo. Devuelve {módulo: (propio µs, acumulado µs)}.
+    """
+    entorno = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    salida = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {modulo}"],
+        capture_output=True, text=True, check=True, env=entorno,
+    ).stderr
+    tiempos = {}
+    for linea in salida.splitlines():
+        if not linea.startswith("import time:") or "self [us]" in linea:
+            continue
+        propio, acumulado, nombre = linea[len("import time:"):].split("|")
+        tiempos[nombre.strip()] = (int(propio), int(acumulado))
+    return tiempos
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modulo", default="main")
+    parser.add_argument("--presupuesto-ms", type=float, default=1500, help="tiempo máximo de `import main`")
+    parser.add_argument("--repeticiones", type=int, default=3)
+    parser.add_argument("--top", type=int, default=10, help="módulos más lentos que se muestran")
+    args = parser.parse_args()
+
+    # La primera importación compila los .pyc que falten; no cuenta
+    medir_importacion(args.modulo)
+    ejecuciones = [medir_importacion(args.modulo) for _ in range(args.repeticiones)]
+    mejor = min(ejecuciones, key=lambda tiempos: tiempos[args.modulo][1])
+    total_ms = mejor[args.modulo][1] / 1000
+
+    print(f"import {args.modulo}: {total_ms:.0f} ms (presupuesto {args.presupuesto_ms:.0f} ms)")
+    print("módulos más lentos (tiempo propio):")
+    for nombre, (propio, acumulado) in sorted(mejor.items(), key=lambda m: m[1][0], reverse=True)[:args.top]:
+        print(f"  {nombre:40} {propio / 1000:8.1f} ms  (acumulado {acumulado / 1000:8.1f} ms)")
+
+    fallos = []
+    if total_ms > args.presupuesto_ms:
+        fallos.append(f"la importación tarda {total_ms:.0f} ms, más que el presupuesto de {args.presupuesto_ms:.0f} ms")
+    cargados = sorted({nombre.split(".")[0] for nombre in mejor} & set(PEREZOSOS))
+    if cargados:
+        fallos.append(f"se importan al arrancar módulos que deberían cargarse al usarse: {', '.join(cargados)}")
+    for fallo in fallos:
+        print(f"ERROR: {fallo}", file=sys.stderr)
+    sys.exit(1 if fallos else 0)
+
+
+if __name__ == "__main__":
+    main_cli()
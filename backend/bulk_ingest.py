@@ -0,0 +1,279 @@
+"""
+Ingesta masiva de un directorio de tickets en PDF (por ejemplo, años de tickets guardados).
+
+Recorre el directorio y sus subdirectorios, procesa los PDFs en paralelo con el mismo
+parser que la API (pdf_processor) y va escribiendo los resultados por lotes:
+  - Parquet: un fichero part-*.parquet nuevo por lote dentro del directorio de salida
+    (se lee entero con pd.read_parquet(directorio)); necesita pyarrow.
+  - CSV: las filas de cada lote se añaden al final del fichero de salida.
+
+Un manifiesto JSON guarda, por fichero, su tamaño, fecha de modificación y hash. En las
+siguientes ejecuciones se saltan los ficheros que no han cambiado (y los duplicados con el
+mismo contenido), así que solo se procesan los tickets nuevos. El manifiesto se actualiza
+tras escribir cada lote, de modo que una ejecución interrumpida se puede reanudar sin
+duplicar filas. Si cambia la versión del parser (o se añade o quita --clasificar) se vuelve
+a procesar todo: se borra el fichero CSV de salida o los part-*.parquet del directorio, y
+nada más. La salida no puede ser el directorio de los PDFs ni uno que lo contenga. Las filas de un
+PDF cuyo contenido cambie se añaden de nuevo (las anteriores no se borran de la salida).
+
+Uso (desde backend/):
+  python bulk_ingest.py tickets/ --salida tickets.parquet [--workers N] [--clasificar]
+  python bulk_ingest.py tickets/ --salida tickets.csv
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from pdf_processor import PARSER_VERSION, parse_pdf
+
+# Tipos fijos de las columnas, para que todos los lotes tengan el mismo esquema
+COLUMNAS = {
+    "Número de artículos": "Int64",
+    "Descripción": "string",
+    "P. Unit": "float64",
+    "Importe": "float64",
+    "Fecha": "string",
+    "Hora": "string",
+    "Fichero": "string",
+}
+
+
+def buscar_pdfs(directorio):
+    """
+    Rutas relativas de todos los PDFs del directorio y sus subdirectorios, ordenadas.
+    """
+    rutas = []
+    for raiz, _, ficheros in os.walk(directorio):
+        for fichero in ficheros:
+            if fichero.lower().endswith(".pdf"):
+                rutas.append(os.path.relpath(os.path.join(raiz, fichero), directorio))
+    return sorted(rutas)
+
+
+def procesar_fichero(directorio, ruta):
+    """
+    Leer, calcular el hash y procesar un PDF (se ejecuta en un proceso del pool).
+    Devuelve (ruta, sha256, DataFrame o None si no se pudo leer).
+    """
+    with open(os.path.join(directorio, ruta), "rb") as fichero:
+        contenido = fichero.read()
+    clave = hashlib.sha256(contenido).hexdigest()
+    df = parse_pdf(contenido)
+    if df is not None:
+        df.attrs.pop("tiempos", None)  # Solo las usa la API; no deben acabar en los metadatos del Parquet
+    return ruta, clave, df
+
+
+class Manifest:
+    """
+    Registro de los ficheros ya procesados: ruta -> tamaño, mtime, sha256 y filas escritas.
+    Se descarta si cambia la versión del parser o si se añade o quita `--clasificar`, ya que
+    entonces las filas nuevas no tendrían las mismas columnas que la salida anterior.
+    """
+
+    def __init__(self, path, clasificar=False):
+        self.path = path
+        self.clasificar = clasificar
+        self.ficheros = {}
+        self.hashes = set()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                datos = json.load(f)
+            if datos.get("parser_version") == PARSER_VERSION and datos.get("clasificar", False) == clasificar:
+                self.ficheros = datos.get("ficheros", {})
+                self.hashes = {entrada["sha256"] for entrada in self.ficheros.values()}
+
+    @property
+    def vacio(self):
+        return not self.ficheros
+
+    def sin_cambios(self, ruta, stat):
+        entrada = self.ficheros.get(ruta)
+        return entrada is not None and entrada["tamano"] == stat.st_size and entrada["mtime"] == stat.st_mtime
+
+    def registrar(self, ruta, stat, clave, filas, error=False):
+        self.ficheros[ruta] = {"tamano": stat.st_size, "mtime": stat.st_mtime, "sha256": clave, "filas": filas, "error": error}
+        self.hashes.add(clave)
+
+    def guardar(self):
+        # Escritura atómica: un corte a mitad de escritura no deja el manifiesto roto
+        temporal = self.path + ".tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            json.dump({"parser_version": PARSER_VERSION, "clasificar": self.clasificar, "ficheros": self.ficheros}, f, ensure_ascii=False)
+        os.replace(temporal, self.path)
+
+
+def _partes_parquet(salida):
+    return glob.glob(os.path.join(glob.escape(salida), "part-*.parquet"))
+
+
+def problema_salida(directorio, salida, formato, manifiesto):
+    """
+    Motivo por el que no se puede escribir en `salida`, o None. Al empezar de cero solo se
+    borra lo que escribe esta herramienta, y solo si no hay dudas de que lo escribió ella.
+    """
+    entrada, destino = os.path.realpath(directorio), os.path.realpath(salida)
+    if os.path.commonpath([entrada, destino]) == destino:
+        return "--salida no puede ser el directorio de los PDFs ni uno que lo contenga"
+    if formato == "csv" and os.path.isdir(salida):
+        return f"--salida {salida} es un directorio; la salida CSV debe ser un fichero"
+    if formato == "parquet" and os.path.exists(salida) and not os.path.isdir(salida):
+        return f"--salida {salida} ya existe y no es un directorio"
+    if formato == "parquet" and not os.path.exists(manifiesto) and _partes_parquet(salida):
+        return f"{salida} ya tiene ficheros part-*.parquet que no figuran en ningún manifiesto"
+    return None
+
+
+class BatchWriter:
+    """
+    Escribe los lotes de filas en la salida a medida que se completan, sin mantener en
+    memoria más que el lote actual. Al reiniciar solo se borran el fichero CSV o los
+    part-*.parquet de la salida, nunca otros ficheros.
+    """
+
+    def __init__(self, salida, formato, reiniciar):
+        self.salida = salida
+        self.formato = formato
+        if reiniciar:
+            if formato == "parquet":
+                for parte in _partes_parquet(salida):
+                    os.remove(parte)
+            elif os.path.isfile(salida):
+                os.remove(salida)
+        if formato == "parquet":
+            os.makedirs(salida, exist_ok=True)
+        self._prefijo = time.strftime("%Y%m%d-%H%M%S")
+        self._partes = 0
+
+    def escribir(self, df):
+        if self.formato == "parquet":
+            self._partes += 1
+            df.to_parquet(os.path.join(self.salida, f"part-{self._prefijo}-{self._partes:05d}.parquet"), index=False)
+        else:
+            df.to_csv(self.salida, mode="a", header=not os.path.exists(self.salida), index=False)
+
+
+def preparar_lote(dataframes, clasificador):
+    df = pd.concat([df.astype(COLUMNAS) for df in dataframes], ignore_index=True)
+    if clasificador is not None:
+        df["Clasificación"] = clasificador.classify_many(df["Descripción"]).astype("string")
+    return df
+
+
+def ingestar(directorio, salida, formato, manifiesto, workers, filas_por_lote, clasificar=False, forzar=False):
+    """
+    Procesar los PDFs nuevos o modificados de `directorio` y añadir sus filas a `salida`.
+    Devuelve un resumen con los ficheros procesados, saltados y con error y las filas escritas.
+    """
+    inicio = time.perf_counter()
+    problema = problema_salida(directorio, salida, formato, manifiesto)
+    if problema:
+        raise ValueError(problema)
+    manifest = Manifest(manifiesto, clasificar)
+    if forzar:
+        manifest.ficheros, manifest.hashes = {}, set()
+    # Sin manifiesto válido la salida anterior no se corresponde con nada: se empieza de cero
+    writer = BatchWriter(salida, formato, reiniciar=manifest.vacio)
+    clasificador = None
+    if clasificar:
+        from classifier import get_classifier
+        clasificador = get_classifier()
+
+    rutas = buscar_pdfs(directorio)
+    pendientes, stats = [], {}
+    for ruta in rutas:
+        stat = os.stat(os.path.join(directorio, ruta))
+        if manifest.sin_cambios(ruta, stat):
+            continue
+        pendientes.append(ruta)
+        stats[ruta] = stat
+    resumen = {
+        "encontrados": len(rutas), "sin_cambios": len(rutas) - len(pendientes),
+        "procesados": 0, "duplicados": 0, "errores": 0, "filas": 0,
+    }
+
+    lote, filas_lote, registros = [], 0, []
+    vistos = set(manifest.hashes)
+
+    def vaciar():
+        nonlocal lote, filas_lote, registros
+        if lote:
+            writer.escribir(preparar_lote(lote, clasificador))
+        for registro in registros:
+            manifest.registrar(*registro)
+        manifest.guardar()
+        resumen["filas"] += filas_lote
+        lote, filas_lote, registros = [], 0, []
+
+    # Con un solo proceso no compensa arrancar el pool: se procesa aquí mismo
+    pool = ProcessPoolExecutor(max_workers=workers, max_tasks_per_child=100) if workers > 1 else None
+    try:
+        if pool:
+            resultados = pool.map(procesar_fichero, [directorio] * len(pendientes), pendientes, chunksize=4)
+        else:
+            resultados = (procesar_fichero(directorio, ruta) for ruta in pendientes)
+        for ruta, clave, df in resultados:
+            stat = stats[ruta]
+            if df is None:
+                resumen["errores"] += 1
+                registros.append((ruta, stat, clave, 0, True))
+                continue
+            if clave in vistos:
+                resumen["duplicados"] += 1  # Mismo ticket con otro nombre, o el mismo fichero tocado
+                registros.append((ruta, stat, clave, 0))
+                continue
+            vistos.add(clave)
+            resumen["procesados"] += 1
+            if not df.empty:
+                lote.append(df.assign(Fichero=ruta))
+                filas_lote += len(df)
+            registros.append((ruta, stat, clave, len(df)))
+            if filas_lote >= filas_por_lote:
+                vaciar()
+    finally:
+        if pool:
+            pool.shutdown(cancel_futures=True)
+    vaciar()
+
+    resumen["segundos"] = round(time.perf_counter() - inicio, 2)
+    return resumen
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directorio", nargs="?", default="tickets", help="directorio con los PDFs (por defecto: tickets)")
+    parser.add_argument("--salida", default="tickets.csv", help="fichero .csv o directorio .parquet de salida")
+    parser.add_argument("--formato", choices=("csv", "parquet"), help="por defecto, según la extensión de --salida")
+    parser.add_argument("--manifiesto", help="por defecto, <salida>.manifest.json")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="procesos que leen PDFs")
+    parser.add_argument("--filas-por-lote", type=int, default=50_000, help="filas acumuladas antes de escribir")
+    parser.add_argument("--clasificar", action="store_true", help="añadir la columna Clasificación con las reglas por defecto")
+    parser.add_argument("--forzar", action="store_true", help="ignorar el manifiesto y procesar todo de nuevo")
+    args = parser.parse_args()
+
+    salida = args.salida.rstrip("/")
+    formato = args.formato or ("parquet" if salida.endswith(".parquet") else "csv")
+    if formato == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            parser.error("la salida en Parquet necesita pyarrow instalado (o usa --salida fichero.csv)")
+    manifiesto = args.manifiesto or f"{salida}.manifest.json"
+    problema = problema_salida(args.directorio, salida, formato, manifiesto)
+    if problema:
+        parser.error(problema)
+    resumen = ingestar(
+        args.directorio, salida, formato, manifiesto,
+        args.workers, args.filas_por_lote, args.clasificar, args.forzar,
+    )
+    print(json.dumps(resumen, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+from fastapi import HTTPException
+
+# Granularidades de los gráficos -> frecuencia de pandas con la que se agrupan los días
+# (las semanas empiezan en lunes)
+GRANULARIDADES = {"day": "D", "week": "W", "month": "M"}
+
+
+def validar_granularidad(granularidad):
+    if granularidad not in GRANULARIDADES:
+        raise HTTPException(status_code=400, detail=f"Granularidad no soportada. Usa una de: {', '.join(GRANULARIDADES)}")
+
+
+def parse_fechas(fechas):
+    """
+    Convertir una columna de fechas dd/mm/aaaa en fechas reales (NaT si no son válidas).
+    Cada fecha distinta se convierte una sola vez: hay muchas menos fechas que líneas.
+    """
+    import pandas as pd
+    codigos, unicas = pd.factorize(fechas)
+    convertidas = pd.DatetimeIndex(pd.to_datetime(pd.Series(unicas, dtype=object), format="%d/%m/%Y", errors="coerce"))
+    return pd.Series(convertidas.take(codigos, allow_fill=True), index=fechas.index, name=fechas.name)
+
+
+def agregar(filas, granularidad):
+    """
+    Series de los gráficos a partir de filas (fecha, clasificación, importe) ya agregadas
+    por día y categoría.
+
+    Se agrupa una sola vez por periodo y categoría; la serie total y el gasto por categoría
+    salen de ese resultado, que ya es pequeño. Los periodos se identifican por su primer día
+    en formato ISO (aaaa-mm-dd), de modo que se ordenan bien también como texto.
+    """
+    import pandas as pd
+    df = pd.DataFrame(filas, columns=["fecha", "clasificacion", "importe"])
+    if df.empty:
+        return {"serie_temporal": [], "serie_categoria": [], "gasto_categoria": []}
+
+    periodo = pd.to_datetime(df["fecha"]).dt.to_period(GRANULARIDADES[granularidad]).dt.start_time
+    por_categoria = df["importe"].groupby([periodo.rename("Fecha"), df["clasificacion"].rename("Clasificación")]).sum()
+    serie = por_categoria.groupby(level="Fecha").sum()
+    gasto = por_categoria.groupby(level="Clasificación").sum()
+
+    serie_categoria = por_categoria.round(2).rename("Importe").reset_index()
+    serie_categoria["Fecha"] = serie_categoria["Fecha"].dt.strftime("%Y-%m-%d")
+    serie_temporal = serie.round(2).rename("Importe").reset_index()
+    serie_temporal["Fecha"] = serie_temporal["Fecha"].dt.strftime("%Y-%m-%d")
+    return {
+        "serie_temporal": serie_temporal.to_dict(orient="records"),
+        "serie_categoria": serie_categoria.to_dict(orient="records"),
+        "gasto_categoria": gasto.round(2).rename("Importe").reset_index().to_dict(orient="records"),
+    }
@@ -1,9 +1,28 @@
+import copy
 import json
 
-# Ruta del archivo JSON que contiene las clasificaciones
+from fastapi import HTTPException
+from sqlalchemy import insert, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.future import select
+
+import metrics
+from users import models
+
+# Ruta del archivo JSON con las clasificaciones por defecto (las de los usuarios que no han cambiado ninguna)
 CLASIFICACIONES_FILE = 'clasificaciones.json'
 
-# Cargar las clasificaciones desde el archivo JSON
+# Intentos de guardar un cambio cuando otra petición ha modificado las reglas a la vez
+MAX_REINTENTOS = 5
+
+# Funciones a las que se avisa cuando cambian las clasificaciones de un usuario
+_suscriptores = []
+
+# Registrar una función que recibirá (usuario, versión, clasificaciones, anteriores) tras cada cambio
+def subscribe(callback):
+    _suscriptores.append(callback)
+
+# Cargar las clasificaciones por defecto desde el archivo JSON
 def load_classifications():
     try:
         with open(CLASIFICACIONES_FILE, 'r', encoding='utf-8') as file:
@@ -12,68 +31,122 @@ def load_classifications():
     except FileNotFoundError:
         return {}
 
-# Guardar las clasificaciones en el archivo JSON
-def save_classifications(clasificaciones):
-    with open(CLASIFICACIONES_FILE, 'w', encoding='utf-8') as file:
-        json.dump({'clasificaciones': clasificaciones}, file, ensure_ascii=False, indent=4)
+# Obtener la versión de las reglas de un usuario (0 = usa las clasificaciones por defecto)
+async def get_rules_version(db, user_name):
+    result = await db.execute(
+        select(models.ClassificationRuleSet.version).filter(models.ClassificationRuleSet.user_name == user_name)
+    )
+    return result.scalar() or 0
+
+# Obtener (versión, clasificaciones) de un usuario
+async def get_rule_set(db, user_name):
+    result = await db.execute(
+        select(models.ClassificationRuleSet.version, models.ClassificationRuleSet.clasificaciones)
+        .filter(models.ClassificationRuleSet.user_name == user_name)
+    )
+    fila = result.first()
+    if fila is None:
+        return 0, load_classifications()
+    return fila.version, json.loads(fila.clasificaciones)
+
+# Guardar una nueva versión solo si nadie la ha cambiado desde que se leyó.
+# Devuelve la nueva versión, o None si hubo un cambio concurrente.
+async def _save_rule_set(db, user_name, version, clasificaciones):
+    datos = json.dumps(clasificaciones, ensure_ascii=False)
+    try:
+        if version == 0:
+            await db.execute(insert(models.ClassificationRuleSet).values(
+                user_name=user_name, version=1, clasificaciones=datos))
+        else:
+            result = await db.execute(
+                update(models.ClassificationRuleSet)
+                .where(models.ClassificationRuleSet.user_name == user_name, models.ClassificationRuleSet.version == version)
+                .values(version=version + 1, clasificaciones=datos)
+            )
+            if result.rowcount == 0:
+                await db.rollback()
+                return None
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()  # Otra petición creó el conjunto de reglas a la vez
+        return None
+    return version + 1
+
+# Aplicar un cambio a las clasificaciones de un usuario con escritura atómica y versionada.
+# `cambio` modifica las clasificaciones y devuelve el mensaje de éxito, o lanza HTTPException.
+async def _modify(db, user_name, operacion, cambio):
+    with metrics.CLASSIFICATION_SECONDS.time(operation=operacion):
+        return await _modify_con_reintentos(db, user_name, cambio)
+
+async def _modify_con_reintentos(db, user_name, cambio):
+    for _ in range(MAX_REINTENTOS):
+        version, anteriores = await get_rule_set(db, user_name)
+        clasificaciones = copy.deepcopy(anteriores)
+        resultado = cambio(clasificaciones)
+        nueva_version = await _save_rule_set(db, user_name, version, clasificaciones)
+        if nueva_version is not None:
+            for callback in _suscriptores:
+                callback(user_name, nueva_version, clasificaciones, anteriores)
+            return resultado
+        metrics.CLASSIFICATION_CONFLICTS.inc()
+    raise HTTPException(status_code=409, detail="Las clasificaciones se están modificando, inténtalo de nuevo")
 
 # Obtener todas las clasificaciones
-def get_all_classifications():
-    clasificaciones = load_classifications()
+async def get_all_classifications(db, user_name):
+    with metrics.CLASSIFICATION_SECONDS.time(operation="get_all"):
+        _, clasificaciones = await get_rule_set(db, user_name)
     return clasificaciones
 
 # Añadir una nueva clasificación con palabras clave
-def add_classification(name, keywords):
-    clasificaciones = load_classifications()
+async def add_classification(db, user_name, name, keywords):
     name = name.lower()  # Normalizar el nombre de la clasificación
 
-    if name in clasificaciones:
-        return {"error": "La clasificación ya existe"}, 400
-    
-    clasificaciones[name] = [kw.lower() for kw in keywords]  # Normalizar las palabras clave
-    save_classifications(clasificaciones)
-    return {"message": f"Clasificación '{name}' añadida con éxito"}
+    def cambio(clasificaciones):
+        if name in clasificaciones:
+            raise HTTPException(status_code=400, detail="La clasificación ya existe")
+        clasificaciones[name] = [kw.lower() for kw in keywords]  # Normalizar las palabras clave
+        return {"message": f"Clasificación '{name}' añadida con éxito"}
+
+    return await _modify(db, user_name, "add_classification", cambio)
 
 # Eliminar una clasificación existente
-def delete_classification(name):
-    clasificaciones = load_classifications()
+async def delete_classification(db, user_name, name):
     name = name.lower()  # Normalizar el nombre de la clasificación
 
-    if name not in clasificaciones:
-        return {"error": "La clasificación no existe"}, 404
-    
-    del clasificaciones[name]
-    save_classifications(clasificaciones)
-    return {"message": f"Clasificación '{name}' eliminada con éxito"}
+    def cambio(clasificaciones):
+        if name not in clasificaciones:
+            raise HTTPException(status_code=404, detail="La clasificación no existe")
+        del clasificaciones[name]
+        return {"message": f"Clasificación '{name}' eliminada con éxito"}
+
+    return await _modify(db, user_name, "delete_classification", cambio)
 
 # Añadir una palabra clave a una clasificación existente
-def add_keyword(name, keyword):
-    clasificaciones = load_classifications()
+async def add_keyword(db, user_name, name, keyword):
     name = name.lower()  # Normalizar el nombre de la clasificación
     keyword = keyword.lower()  # Normalizar la palabra clave
 
-    if name not in clasificaciones:
-        return {"error": "La clasificación no existe"}, 404
+    def cambio(clasificaciones):
+        if name not in clasificaciones:
+            raise HTTPException(status_code=404, detail="La clasificación no existe")
+        if keyword in clasificaciones[name]:
+            raise HTTPException(status_code=400, detail="La palabra clave ya existe en esta clasificación")
+        clasificaciones[name].append(keyword)
+        return {"message": f"Palabra clave '{keyword}' añadida a la clasificación '{name}'"}
 
-    if keyword in clasificaciones[name]:
-        return {"error": "La palabra clave ya existe en esta clasificación"}, 400
-    
-    clasificaciones[name].append(keyword)
-    save_classifications(clasificaciones)
-    return {"message": f"Palabra clave '{keyword}' añadida a la clasificación '{name}'"}
+    return await _modify(db, user_name, "add_keyword", cambio)
 
 # Eliminar una palabra clave de una clasificación existente
-def delete_keyword(name, keyword):
-    clasificaciones = load_classifications()
+async def delete_keyword(db, user_name, name, keyword):
     name = name.lower()  # Normalizar el nombre de la clasificación
     keyword = keyword.lower()  # Normalizar la palabra clave
 
-    if name not in clasificaciones:
-        return {"error": "La clasificación no existe"}, 404
-    
-    if keyword not in clasificaciones[name]:
-        return {"error": "La palabra clave no existe en esta clasificación"}, 404
-    
-    clasificaciones[name].remove(keyword)
-    save_classifications(clasificaciones)
-    return {"message": f"Palabra clave '{keyword}' eliminada de la clasificación '{name}'"}
+    def cambio(clasificaciones):
+        if name not in clasificaciones:
+            raise HTTPException(status_code=404, detail="La clasificación no existe")
+        if keyword not in clasificaciones[name]:
+            raise HTTPException(status_code=404, detail="La palabra clave no existe en esta clasificación")
+        clasificaciones[name].remove(keyword)
+        return {"message": f"Palabra clave '{keyword}' eliminada de la clasificación '{name}'"}
+
+    return await _modify(db, user_name, "delete_keyword", cambio)
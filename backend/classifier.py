@@ -0,0 +1,344 @@
+import difflib
+import functools
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import unidecode
+
+import metrics
+from classification_manager import get_rule_set, get_rules_version, load_classifications, subscribe
+
+# Descripciones ya clasificadas que recuerda cada clasificador, las menos usadas se
+# olvidan primero (0 desactiva la caché)
+CLASSIFIER_CACHE_MAX = int(os.getenv("CLASSIFIER_CACHE_MAX", "100000"))
+# Clasificadores de usuarios con reglas propias que se mantienen compilados; los usados
+# hace más tiempo se descartan primero y se vuelven a compilar si hacen falta
+CLASSIFIER_USERS_MAX = int(os.getenv("CLASSIFIER_USERS_MAX", "1000"))
+# Parecido mínimo (0-1, difflib) entre una palabra de la descripción y una palabra clave para
+# clasificar por aproximación las descripciones sin coincidencia exacta (0 la desactiva)
+CLASSIFIER_FUZZY_CUTOFF = float(os.getenv("CLASSIFIER_FUZZY_CUTOFF", "0.85"))
+# Versión del algoritmo de clasificación: forma parte de la versión de cada clasificador,
+# así que al cambiarla no se reutilizan los tickets clasificados con el algoritmo anterior
+ALGORITHM_VERSION = 2
+# Las palabras más cortas no se comparan por aproximación: casi todo se les parece
+LONGITUD_MINIMA_APROXIMADA = 4
+
+# Abreviaturas con las que Mercadona acorta los nombres en los tickets ("YOG. GRIEGO")
+ABREVIATURAS = {
+    "beb": "bebida",
+    "cerv": "cerveza",
+    "choc": "chocolate",
+    "desn": "desnatado",
+    "gall": "galleta",
+    "lech": "leche",
+    "nat": "natural",
+    "qso": "queso",
+    "refr": "refresco",
+    "semi": "semidesnatado",
+    "verd": "verdura",
+    "yog": "yogur",
+    "zum": "zumo",
+}
+
+PALABRA_RE = re.compile(r"[a-z0-9]+")
+
+# Normalizar cadenas (minúsculas y sin acentos)
+def normalize_string(s):
+    return unidecode.unidecode(s).lower() if isinstance(s, str) else s
+
+
+@functools.lru_cache(maxsize=CLASSIFIER_CACHE_MAX)
+def normalize_description(descripcion):
+    """
+    Forma normalizada de una descripción o palabra clave: sin acentos, en minúsculas, sin
+    signos de puntuación y con las abreviaturas conocidas desarrolladas
+    ("YOG. GRIEGO" -> "yogur griego"). Es la clave del índice de descripciones.
+    """
+    palabras = PALABRA_RE.findall(unidecode.unidecode(descripcion).lower())
+    return " ".join(ABREVIATURAS.get(palabra, palabra) for palabra in palabras)
+
+
+def _parecidas(palabra, vocabulario, cutoff):
+    """
+    Palabras del vocabulario parecidas a `palabra`, con su parecido: las que empiezan por
+    ella (nombres truncados) cuentan como iguales; el resto se compara con difflib.
+    """
+    if len(palabra) < LONGITUD_MINIMA_APROXIMADA:
+        return []
+    parecidas = [(candidata, 1.0) for candidata in vocabulario if candidata.startswith(palabra)]
+    comparador = difflib.SequenceMatcher(b=palabra)
+    for candidata in vocabulario:
+        comparador.set_seq1(candidata)
+        if comparador.real_quick_ratio() >= cutoff and comparador.quick_ratio() >= cutoff:
+            parecido = comparador.ratio()
+            if parecido >= cutoff:
+                parecidas.append((candidata, parecido))
+    return parecidas
+
+
+class KeywordClassifier:
+    """
+    Clasificador compilado a partir de las reglas de palabras clave.
+
+    Descripciones y palabras clave se comparan normalizadas (normalize_description).
+    Todas las palabras clave se compilan en una única expresión regular con un
+    grupo por categoría. La búsqueda se hace con un lookahead en cada posición,
+    de modo que se detectan coincidencias solapadas y se conserva la semántica
+    original: gana la primera categoría (en el orden del JSON) que tenga alguna
+    palabra clave contenida en la descripción.
+
+    Si ninguna palabra clave está contenida en la descripción, se busca por aproximación
+    la palabra clave (de una sola palabra) más parecida a alguna palabra de la descripción;
+    gana la más parecida y, a igual parecido, la categoría más prioritaria.
+    """
+
+    def __init__(self, clasificaciones, rules_version=0):
+        self.clasificaciones = clasificaciones
+        # Versión de las reglas en el almacén (0 = reglas por defecto)
+        self.rules_version = rules_version
+        # Identifica el contenido de las reglas; cambia en cuanto cambia cualquier regla
+        reglas = json.dumps(clasificaciones, ensure_ascii=False)
+        self.version = hashlib.sha256(f"{ALGORITHM_VERSION}:{reglas}".encode('utf-8')).hexdigest()[:16]
+        self.categorias = []
+        grupos = []
+        # Palabra clave de una sola palabra -> índice de la categoría más prioritaria que la tiene
+        self._vocabulario = {}
+        for categoria, palabras_clave in clasificaciones.items():
+            palabras_clave = [p for p in (normalize_description(p) for p in palabras_clave) if p]
+            if not palabras_clave:
+                continue  # Una categoría sin palabras clave nunca coincide
+            alternativas = "|".join(re.escape(palabra) for palabra in palabras_clave)
+            grupos.append(f"({alternativas})")
+            for palabra in palabras_clave:
+                if " " not in palabra:
+                    self._vocabulario.setdefault(palabra, len(self.categorias))
+            self.categorias.append(categoria)
+        self._patron = re.compile(f"(?=(?:{'|'.join(grupos)}))") if grupos else None
+        # Todas las etiquetas normalizadas que puede devolver, para que las columnas
+        # categóricas de distintos lotes compartan categorías y se concatenen sin copiar
+        import pandas as pd
+        self._etiquetas = {c: normalize_string(c) for c in self.categorias + ['Otros']}
+        self.etiquetas = pd.Index(sorted(set(self._etiquetas.values())))
+        # Índice LRU descripción normalizada -> categoría, válido para estas reglas
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    def classify(self, descripcion):
+        """
+        Clasificar una descripción. Si ninguna palabra clave coincide, devuelve 'Otros'.
+        """
+        descripcion = normalize_description(descripcion)
+        with self._cache_lock:
+            categoria = self._cache.get(descripcion)
+            if categoria is not None:
+                self._cache.move_to_end(descripcion)
+                return categoria
+        categoria = self._classify_normalized(descripcion)
+        self._recordar({descripcion: categoria})
+        return categoria
+
+    def _recordar(self, categorias):
+        if CLASSIFIER_CACHE_MAX <= 0:
+            return
+        with self._cache_lock:
+            self._cache.update(categorias)
+            while len(self._cache) > CLASSIFIER_CACHE_MAX:
+                self._cache.popitem(last=False)
+
+    def _classify_normalized(self, descripcion):
+        if self._patron is None:
+            return 'Otros'
+
+        # En cada posición la alternancia elige la categoría más prioritaria que
+        # empieza ahí, así que basta con quedarse con el mínimo de todas ellas
+        mejor = None
+        for match in self._patron.finditer(descripcion):
+            indice = match.lastindex - 1
+            if mejor is None or indice < mejor:
+                mejor = indice
+                if mejor == 0:
+                    break
+        if mejor is None:
+            mejor = self._classify_fuzzy(descripcion)
+        return self.categorias[mejor] if mejor is not None else 'Otros'
+
+    def _classify_fuzzy(self, descripcion):
+        if CLASSIFIER_FUZZY_CUTOFF <= 0:
+            return None
+        mejor = None  # (parecido, -índice de la categoría)
+        for palabra in set(descripcion.split()):
+            for palabra_clave, parecido in _parecidas(palabra, self._vocabulario, CLASSIFIER_FUZZY_CUTOFF):
+                candidata = (parecido, -self._vocabulario[palabra_clave])
+                if mejor is None or candidata > mejor:
+                    mejor = candidata
+        return -mejor[1] if mejor is not None else None
+
+    def derive(self, clasificaciones, rules_version, cambiadas):
+        """
+        Compilar el clasificador de unas reglas nuevas conservando la caché de descripciones
+        de este, salvo las que coinciden (exactamente o por aproximación) con alguna de las
+        palabras clave `cambiadas`, que son las únicas cuya categoría puede haber cambiado.
+        """
+        nuevo = KeywordClassifier(clasificaciones, rules_version=rules_version)
+        afectada = keyword_matcher(cambiadas)
+        with self._cache_lock:
+            cache = self._cache.copy()
+        nuevo._cache = OrderedDict((d, e) for d, e in cache.items() if not afectada(d)) if afectada else cache
+        return nuevo
+
+    def classify_many(self, descripciones):
+        """
+        Clasificar una Series completa de descripciones de una vez.
+
+        Cada descripción única se normaliza y se busca en el índice; solo las que no están
+        se clasifican (y solo las que no contienen ninguna palabra clave pasan por la
+        búsqueda aproximada). El resultado se reconstruye a partir de los códigos de
+        factorización y se devuelve como una columna categórica con los nombres de
+        categoría ya normalizados.
+        """
+        import pandas as pd
+        codigos, unicas = pd.factorize(descripciones.fillna(''))
+        normalizadas = [normalize_description(str(descripcion)) for descripcion in unicas]
+        cache = self._cache
+        with self._cache_lock:
+            categorias = [cache.get(descripcion) for descripcion in normalizadas]
+            for descripcion, categoria in zip(normalizadas, categorias):
+                if categoria is not None:
+                    cache.move_to_end(descripcion)
+        nuevas = {}
+        for i, categoria in enumerate(categorias):
+            if categoria is None:
+                descripcion = normalizadas[i]
+                categoria = nuevas.get(descripcion)
+                if categoria is None:
+                    categoria = nuevas[descripcion] = self._classify_normalized(descripcion)
+                categorias[i] = categoria
+        if nuevas:
+            self._recordar(nuevas)
+        etiquetas = [self._etiquetas[categoria] for categoria in categorias]
+        metrics.CLASSIFIER_CACHE.inc(len(unicas) - len(nuevas), result="hit")
+        metrics.CLASSIFIER_CACHE.inc(len(nuevas), result="miss")
+        codigos_etiqueta = self.etiquetas.get_indexer(etiquetas)
+        clasificacion = pd.Categorical.from_codes(codigos_etiqueta[codigos], categories=self.etiquetas)
+        return pd.Series(clasificacion, index=descripciones.index, name='Clasificación')
+
+
+def changed_keywords(anteriores, nuevas):
+    """
+    Palabras clave cuyas coincidencias pueden clasificar distinto con las reglas `nuevas`
+    que con las `anteriores`: las añadidas o quitadas de alguna categoría y, si cambió la
+    prioridad relativa de las categorías, todas las de ambas reglas.
+    """
+    pares_anteriores = {(c, p) for c, palabras in anteriores.items() for p in palabras}
+    pares_nuevos = {(c, p) for c, palabras in nuevas.items() for p in palabras}
+    comunes = [c for c in anteriores if c in nuevas]
+    if comunes != [c for c in nuevas if c in anteriores]:
+        return {p for _, p in pares_anteriores | pares_nuevos}
+    return {p for _, p in pares_anteriores ^ pares_nuevos}
+
+
+def keyword_matcher(palabras_clave):
+    """
+    Función que dice si una descripción coincide con alguna de las palabras clave, exactamente
+    o por aproximación, es decir, si su categoría puede depender de ellas (o None si no hay
+    ninguna palabra clave).
+    """
+    palabras_clave = {p for p in (normalize_description(p) for p in palabras_clave) if p}
+    if not palabras_clave:
+        return None
+    patron = re.compile("|".join(re.escape(palabra) for palabra in sorted(palabras_clave)))
+    vocabulario = [p for p in palabras_clave if " " not in p]
+
+    def coincide(descripcion):
+        descripcion = normalize_description(descripcion)
+        if patron.search(descripcion):
+            return True
+        if CLASSIFIER_FUZZY_CUTOFF <= 0:
+            return False
+        return any(_parecidas(palabra, vocabulario, CLASSIFIER_FUZZY_CUTOFF) for palabra in set(descripcion.split()))
+
+    return coincide
+
+
+_classifier = None
+_lock = threading.Lock()
+# Clasificadores compilados de los usuarios con reglas propias: usuario -> KeywordClassifier,
+# del usado hace más tiempo al más reciente
+_user_classifiers = OrderedDict()
+_user_classifiers_lock = threading.Lock()
+
+
+def _get_user_entry(user_name):
+    with _user_classifiers_lock:
+        clasificador = _user_classifiers.get(user_name)
+        if clasificador is not None:
+            _user_classifiers.move_to_end(user_name)
+        return clasificador
+
+
+def _set_user_entry(user_name, clasificador):
+    with _user_classifiers_lock:
+        _user_classifiers[user_name] = clasificador
+        _user_classifiers.move_to_end(user_name)
+        while len(_user_classifiers) > max(1, CLASSIFIER_USERS_MAX):
+            _user_classifiers.popitem(last=False)
+
+
+def reload_classifier(clasificaciones=None):
+    """
+    Compilar un nuevo clasificador por defecto y sustituir el actual de forma atómica.
+    Las peticiones en curso siguen usando la instancia anterior hasta terminar.
+    """
+    global _classifier
+    if clasificaciones is None:
+        clasificaciones = load_classifications()
+    nuevo = KeywordClassifier(clasificaciones)
+    _classifier = nuevo
+    return nuevo
+
+
+def get_classifier():
+    """
+    Devolver el clasificador con las reglas por defecto, compilándolo la primera vez que se usa.
+    """
+    clasificador = _classifier
+    if clasificador is None:
+        with _lock:
+            clasificador = _classifier or reload_classifier()
+    return clasificador
+
+
+def _on_rules_changed(user_name, version, clasificaciones, anteriores):
+    # Sustitución atómica del clasificador del usuario en cuanto se guardan sus reglas,
+    # heredando la caché de descripciones del anterior si se compiló con las mismas reglas
+    previo = _get_user_entry(user_name) or get_classifier()
+    if previo.clasificaciones == anteriores:
+        nuevo = previo.derive(clasificaciones, version, changed_keywords(anteriores, clasificaciones))
+    else:
+        nuevo = KeywordClassifier(clasificaciones, rules_version=version)
+    _set_user_entry(user_name, nuevo)
+
+
+async def get_user_classifier(db, user_name):
+    """
+    Devolver el clasificador de un usuario. Solo se consulta la versión de sus reglas;
+    las reglas se leen y se compilan de nuevo únicamente si la versión ha cambiado
+    (por ejemplo, si las modificó otro proceso).
+    """
+    version = await get_rules_version(db, user_name)
+    if version == 0:
+        return get_classifier()
+    clasificador = _get_user_entry(user_name)
+    if clasificador is None or clasificador.rules_version != version:
+        version, clasificaciones = await get_rule_set(db, user_name)
+        clasificador = KeywordClassifier(clasificaciones, rules_version=version)
+        _set_user_entry(user_name, clasificador)
+    return clasificador
+
+
+# Recompilar las reglas de un usuario cada vez que se modifiquen desde classification_manager
+subscribe(_on_rules_changed)
@@ -0,0 +1,374 @@
+import asyncio
+import logging
+import os
+import shutil
+import tempfile
+import time
+import uuid
+
+from starlette.concurrency import run_in_threadpool
+
+import metrics
+import upload_limits
+from classifier import get_user_classifier
+from pdf_processor import PARSER_VERSION
+from pdf_workers import parse_pdfs
+from ticket_cache import get_cache, hash_file
+from users import tickets
+from users.db import async_session
+
+logger = logging.getLogger(__name__)
+
+# Number of CSV rows parsed and classified per chunk
+CSV_CHUNK_ROWS = 50_000
+# Trabajos de ingesta que se procesan a la vez en este proceso
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+# Trabajos sin terminar (en cola o en curso) que puede tener cada usuario
+INGEST_MAX_JOBS_PER_USER = int(os.getenv("INGEST_MAX_JOBS_PER_USER", "2"))
+# PDFs que se procesan y se guardan juntos dentro de un trabajo
+INGEST_PDF_BATCH = int(os.getenv("INGEST_PDF_BATCH", "32"))
+# Segundos que se conserva un trabajo terminado para poder consultarlo
+INGEST_JOB_TTL = float(os.getenv("INGEST_JOB_TTL", "3600"))
+# Filas de cada trabajo que se guardan en memoria para paginar sus resultados (0 sin límite);
+# las demás se guardan igualmente en la base de datos
+INGEST_JOB_RESULT_MAX_ROWS = int(os.getenv("INGEST_JOB_RESULT_MAX_ROWS", "200000"))
+
+
+# Parse PDFs, reusing cached tickets and only reclassifying them if the rules changed.
+# Returns (PDF hash, DataFrame) pairs for the PDFs that could be read, in upload order.
+# The ticket cache is read and written off the event loop, once per call.
+async def procesar_pdfs(ficheros, clasificador):
+    cache = await run_in_threadpool(get_cache)
+    with metrics.UPLOAD_STAGE_SECONDS.time(stage="hash"):
+        claves = [await run_in_threadpool(hash_file, fichero) for fichero in ficheros]
+    # Cached tickets parsed by an older parser version are not reused
+    claves_cache = [f"{clave}:{PARSER_VERSION}" for clave in claves]
+    tickets = [None] * len(ficheros)
+
+    cached = await run_in_threadpool(cache.get_many, claves_cache) if cache else {}
+    guardar = {}  # Tickets que hay que (volver a) guardar en la caché
+    pendientes = []
+    for i, clave in enumerate(claves_cache):
+        if clave not in cached:
+            pendientes.append(i)
+            continue
+        version, df = cached[clave]
+        if version != clasificador.version:
+            with metrics.UPLOAD_STAGE_SECONDS.time(stage="classify"):
+                df['Clasificación'] = clasificador.classify_many(df['Descripción'])
+            guardar[clave] = df
+        tickets[i] = df
+        metrics.UPLOAD_PDFS.inc(result="cached")
+
+    # Solo los PDFs que no están en caché pasan por PyPDF2
+    parsed = await parse_pdfs([ficheros[i] for i in pendientes])
+    for i, df in zip(pendientes, parsed):
+        if df is None:
+            metrics.UPLOAD_PDFS.inc(result="unreadable")
+            continue
+        for fase, segundos in df.attrs.pop("tiempos", {}).items():
+            metrics.UPLOAD_STAGE_SECONDS.observe(segundos, stage=fase)
+        metrics.UPLOAD_PDFS.inc(result="parsed")
+        metrics.UPLOAD_TICKET_LINES.inc(len(df))
+        with metrics.UPLOAD_STAGE_SECONDS.time(stage="classify"):
+            df['Clasificación'] = clasificador.classify_many(df['Descripción'])
+        if cache:
+            guardar[claves_cache[i]] = df
+        tickets[i] = df
+
+    if guardar:
+        await run_in_threadpool(cache.put_many, guardar, clasificador.version)
+    return [(clave, df) for clave, df in zip(claves, tickets) if df is not None]
+
+# Read the CSV in chunks straight from the spooled upload file, yielding each chunk
+# once it is classified
+def leer_csv(fichero, clasificador):
+    import pandas as pd
+    filas = 0
+    lector = iter(pd.read_csv(fichero, encoding='utf-8', chunksize=CSV_CHUNK_ROWS))
+    while True:
+        with metrics.UPLOAD_STAGE_SECONDS.time(stage="csv_read"):
+            df = next(lector, None)
+        if df is None:
+            return
+        filas += len(df)
+        upload_limits.check_csv_rows(filas)
+        with metrics.UPLOAD_STAGE_SECONDS.time(stage="classify"):
+            df['Clasificación'] = clasificador.classify_many(df['Descripción'])
+        metrics.UPLOAD_CSV_ROWS.inc(len(df))
+        yield df
+
+# Read and classify the whole CSV as a single table
+def procesar_csv(fichero, clasificador):
+    import pandas as pd
+    return pd.concat(list(leer_csv(fichero, clasificador)), ignore_index=True)
+
+# Join the processed files into a single table of tickets
+def combinar(dataframes):
+    import pandas as pd
+    with metrics.UPLOAD_STAGE_SECONDS.time(stage="combine"):
+        df_final = pd.concat(dataframes, ignore_index=True)
+        # La clasificación nunca es nula y puede ser categórica, así que no se rellena
+        columnas = df_final.columns.drop("Clasificación")
+        df_final[columnas] = df_final[columnas].fillna(0)
+    return df_final
+
+
+class LocalBroker:
+    """
+    Cola de trabajos en memoria del proceso. Hace las veces de broker: expone solo
+    publish/consume, de modo que se puede sustituir por uno externo (Redis, RabbitMQ...)
+    sin tocar los trabajadores.
+    """
+
+    def __init__(self):
+        self._cola = asyncio.Queue()
+
+    async def publish(self, job_id):
+        await self._cola.put(job_id)
+
+    async def consume(self):
+        return await self._cola.get()
+
+
+class IngestionJob:
+    """
+    Subida procesada en segundo plano. Los ficheros se copian a un directorio temporal al
+    recibir la petición; el trabajador los procesa por lotes (el CSV, por trozos) y guarda
+    las líneas de cada lote en cuanto está listo, de modo que el progreso y los resultados
+    parciales se pueden consultar mientras tanto. Para paginar se conservan como mucho
+    INGEST_JOB_RESULT_MAX_ROWS filas.
+    """
+
+    def __init__(self, user_name, directorio, pdfs, csv):
+        self.id = uuid.uuid4().hex
+        self.user_name = user_name
+        self.directorio = directorio
+        self.pdfs = pdfs
+        self.csv = csv
+        self.estado = "en_cola"
+        self.ficheros_total = len(pdfs) + (1 if csv else 0)
+        self.ficheros_procesados = 0
+        self.ficheros_no_leidos = 0
+        self.filas = 0
+        self.lineas_guardadas = 0
+        self.creado = time.time()
+        self.iniciado = None
+        self.terminado = None
+        self.error = None
+        self._partes = []
+        self._filas_conservadas = 0
+        self.resultado_truncado = False
+
+    @property
+    def activo(self):
+        return self.estado in ("en_cola", "en_curso")
+
+    async def ejecutar(self):
+        self.estado = "en_curso"
+        self.iniciado = time.time()
+        try:
+            await self._procesar()
+            self.estado = "completado"
+        except asyncio.CancelledError:
+            self.estado = "cancelado"
+            raise
+        except upload_limits.UploadTooLarge as exc:
+            self.estado = "error"
+            self.error = exc.detail
+        except Exception as exc:
+            logger.exception("Ingestion job %s failed", self.id)
+            self.estado = "error"
+            self.error = str(exc)
+        finally:
+            self.terminado = time.time()
+            shutil.rmtree(self.directorio, ignore_errors=True)
+
+    async def _procesar(self):
+        for inicio in range(0, len(self.pdfs), INGEST_PDF_BATCH):
+            lote = self.pdfs[inicio:inicio + INGEST_PDF_BATCH]
+            # El clasificador se pide en cada lote para usar las reglas más recientes
+            async with async_session() as db:
+                clasificador = await get_user_classifier(db, self.user_name)
+            ficheros = [open(ruta, "rb") for ruta in lote]
+            try:
+                fuentes = await procesar_pdfs(ficheros, clasificador)
+            finally:
+                for fichero in ficheros:
+                    fichero.close()
+            await self._guardar(fuentes)
+            self.filas += sum(len(df) for _, df in fuentes)
+            self.ficheros_procesados += len(lote)
+            self.ficheros_no_leidos += len(lote) - len(fuentes)
+
+        if self.csv:
+            await self._procesar_csv()
+
+    async def _procesar_csv(self):
+        with open(self.csv, "rb") as fichero:
+            clave = await run_in_threadpool(hash_file, fichero)
+            async with async_session() as db:
+                clasificador = await get_user_classifier(db, self.user_name)
+                ingerido = bool(await tickets.get_ingested_sources(db, self.user_name, [clave]))
+            # Cada trozo se guarda en cuanto está clasificado. Con el primero se registra el
+            # CSV como ingerido, en la misma transacción (si otra subida se adelanta, no se
+            # guarda nada); los demás se añaden a él. Si el trabajo no termina, se deshace
+            # todo lo guardado para que el CSV se pueda volver a subir entero. Un CSV ya
+            # subido se lee igualmente para mostrar sus tickets.
+            reclamado = False
+            guardadas = 0
+            try:
+                trozos = leer_csv(fichero, clasificador)
+                while (df := await run_in_threadpool(next, trozos, None)) is not None:
+                    self.filas += len(df)
+                    if not ingerido:
+                        with metrics.UPLOAD_STAGE_SECONDS.time(stage="store"):
+                            async with async_session() as db:
+                                if not reclamado:
+                                    reclamado = bool(await tickets.claim_sources(db, self.user_name, [clave]))
+                                    ingerido = not reclamado
+                                if reclamado:
+                                    lineas = await tickets.add_ticket_lines(
+                                        db, self.user_name, [(clave, df)], reclamadas={clave})
+                                    guardadas += lineas
+                                    self.lineas_guardadas += lineas
+                    self._conservar(df)
+            except BaseException:
+                if reclamado:
+                    await self._deshacer(clave, guardadas)
+                raise
+        self.ficheros_procesados += 1
+
+    async def _deshacer(self, fuente, guardadas):
+        try:
+            async with async_session() as db:
+                await tickets.remove_source(db, self.user_name, fuente)
+            self.lineas_guardadas -= guardadas
+        except Exception:
+            logger.exception("Could not undo the partial CSV of ingestion job %s", self.id)
+
+    async def _guardar(self, fuentes):
+        if not fuentes:
+            return
+        with metrics.UPLOAD_STAGE_SECONDS.time(stage="store"):
+            async with async_session() as db:
+                self.lineas_guardadas += await tickets.add_ticket_lines(db, self.user_name, fuentes)
+        for _, df in fuentes:
+            self._conservar(df)
+
+    def _conservar(self, df):
+        # Solo se conservan para paginar las primeras INGEST_JOB_RESULT_MAX_ROWS filas
+        if INGEST_JOB_RESULT_MAX_ROWS:
+            hueco = INGEST_JOB_RESULT_MAX_ROWS - self._filas_conservadas
+            if len(df) > hueco:
+                self.resultado_truncado = True
+                df = df.iloc[:hueco]
+            if df.empty:
+                return
+        self._partes.append(df)
+        self._filas_conservadas += len(df)
+
+    def resultado(self):
+        """
+        Tickets procesados hasta ahora (None si todavía no hay ninguno). Las partes se
+        sustituyen por su tabla combinada, que se reutiliza mientras no lleguen lotes nuevos
+        y no se guarda dos veces.
+        """
+        if len(self._partes) > 1:
+            self._partes = [combinar(self._partes)]
+        return self._partes[0] if self._partes else None
+
+    def progreso(self):
+        return {
+            "job_id": self.id,
+            "estado": self.estado,
+            "ficheros_total": self.ficheros_total,
+            "ficheros_procesados": self.ficheros_procesados,
+            "ficheros_no_leidos": self.ficheros_no_leidos,
+            "filas": self.filas,
+            "lineas_guardadas": self.lineas_guardadas,
+            "resultado_truncado": self.resultado_truncado,
+            "creado": self.creado,
+            "iniciado": self.iniciado,
+            "terminado": self.terminado,
+            "error": self.error,
+        }
+
+
+class TooManyJobs(Exception):
+    """El usuario ya tiene el máximo de trabajos de ingesta sin terminar"""
+
+
+_trabajos = {}
+_broker = None
+_trabajadores = []
+
+
+async def _trabajador():
+    while True:
+        job_id = await _broker.consume()
+        trabajo = _trabajos.get(job_id)
+        if trabajo is not None and trabajo.estado == "en_cola":
+            await trabajo.ejecutar()
+
+
+def _arrancar_trabajadores():
+    global _broker
+    if _trabajadores:
+        return
+    _broker = LocalBroker()
+    loop = asyncio.get_running_loop()
+    _trabajadores.extend(loop.create_task(_trabajador()) for _ in range(max(1, INGEST_WORKERS)))
+
+
+def _purgar():
+    ahora = time.time()
+    for job_id in [i for i, t in _trabajos.items() if not t.activo and t.terminado + INGEST_JOB_TTL < ahora]:
+        del _trabajos[job_id]
+
+
+def _copiar(origen, destino):
+    origen.seek(0)
+    with open(destino, "wb") as salida:
+        shutil.copyfileobj(origen, salida)
+    return destino
+
+
+async def submit(user_name, pdfs, csv=None):
+    """
+    Crear un trabajo con los ficheros subidos (objetos de fichero) y encolarlo.
+    Los ficheros se copian a disco porque los de la petición se cierran al responder.
+    """
+    _purgar()
+    if sum(1 for t in _trabajos.values() if t.user_name == user_name and t.activo) >= INGEST_MAX_JOBS_PER_USER:
+        raise TooManyJobs()
+    directorio = tempfile.mkdtemp(prefix="ingesta-")
+    rutas = [await run_in_threadpool(_copiar, f, os.path.join(directorio, f"{i}.pdf")) for i, f in enumerate(pdfs)]
+    ruta_csv = await run_in_threadpool(_copiar, csv, os.path.join(directorio, "datos.csv")) if csv else None
+    trabajo = IngestionJob(user_name, directorio, rutas, ruta_csv)
+    _trabajos[trabajo.id] = trabajo
+    _arrancar_trabajadores()
+    await _broker.publish(trabajo.id)
+    return trabajo
+
+
+def get_job(job_id, user_name):
+    trabajo = _trabajos.get(job_id)
+    return trabajo if trabajo is not None and trabajo.user_name == user_name else None
+
+
+async def shutdown():
+    """
+    Parar los trabajadores (al parar el servidor). Los trabajos en curso quedan cancelados.
+    """
+    global _broker
+    for tarea in _trabajadores:
+        tarea.cancel()
+    await asyncio.gather(*_trabajadores, return_exceptions=True)
+    _trabajadores.clear()
+    _broker = None
+    for trabajo in _trabajos.values():
+        if trabajo.estado == "en_cola":
+            trabajo.estado = "cancelado"
+            trabajo.terminado = time.time()
+            shutil.rmtree(trabajo.directorio, ignore_errors=True)
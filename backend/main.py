@@ -1,17 +1,31 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Depends
-from typing import List
-import pandas as pd
-from pdf_processor import extract_text_from_pdf, process_ticket
+# Load environment variables from .env file before any module reads its settings
+from dotenv import load_dotenv
+load_dotenv()
+
+# Heavy libraries (pandas, PyPDF2, passlib, jose) are imported where they are first used,
+# so a new worker starts serving quickly; benchmarks/import_budget.py keeps an eye on it.
+import datetime
+from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Query
+from typing import List, Optional
+from contextlib import asynccontextmanager
+from pdf_workers import shutdown_pool
 from fastapi.middleware.cors import CORSMiddleware
-import io
-from pdf_processor import clasificar_producto
-import unidecode
+from fastapi.responses import JSONResponse, PlainTextResponse
+from classifier import get_user_classifier
+from ticket_cache import hash_file
+from starlette.concurrency import run_in_threadpool
+import ticket_pages
+import charts
+import reclassification
+import metrics
+import ingestion
+import upload_limits
+from ingestion import procesar_pdfs, procesar_csv, combinar
 from pydantic import BaseModel
 from typing import List
 from sqlalchemy.orm import Session
 from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from jose import JWTError, jwt
 from classification_manager import (
     get_all_classifications,
     add_classification,
@@ -20,10 +34,31 @@ from classification_manager import (
     delete_keyword
 )
 
-from users import models, schemas, auth, security
-from users.db import engine, async_session, get_db
+from users import models, schemas, auth, security, tickets, spend
+from users.db import async_session, dispose_engine, get_db, init_engine
+from users.token_cache import token_cache
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    engine = init_engine()
+    async with engine.begin() as conn:
+        await conn.run_sync(models.Base.metadata.create_all)
+        await conn.run_sync(models.create_missing_indexes)
+    async with async_session() as db:
+        await tickets.ensure_ingested_sources(db)
+        await spend.ensure_spend_aggregates(db)
+        await reclassification.ensure_algorithm_version(db)
+    yield
+    await ingestion.shutdown()
+    await reclassification.shutdown()
+    shutdown_pool()
+    await dispose_engine()
+
+app = FastAPI(lifespan=lifespan)
 
-app = FastAPI()
+# Per-user rate limit and maximum size of uploads, checked before the body is read
+# (added before CORS so that its rejections also carry the CORS headers)
+app.add_middleware(upload_limits.UploadLimitMiddleware, limiter=upload_limits.get_limiter())
 
 # Enable CORS
 app.add_middleware(
@@ -32,38 +67,51 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Total-Count"],
 )
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
+# Too many logins/signups queued for bcrypt: ask the client to retry instead of queueing more
+@app.exception_handler(security.PasswordHasherBusy)
+async def password_hasher_busy_handler(request, exc):
+    return JSONResponse(status_code=503, content={"detail": "Too many login attempts, please retry"}, headers={"Retry-After": "1"})
+
+# The user already has the maximum number of unfinished ingestion jobs
+@app.exception_handler(ingestion.TooManyJobs)
+async def too_many_jobs_handler(request, exc):
+    return JSONResponse(status_code=429, content={"detail": "Too many ingestion jobs in progress, please wait for one to finish"}, headers={"Retry-After": "5"})
+
 # Modelo para validar el cuerpo de la solicitud de añadir nueva clasificación
 class ClassificationInput(BaseModel):
     name: str
     keywords: List[str] = []  # Establecemos un valor por defecto como lista vacía
 
-# Helper function to normalize strings (lowercase and remove accents)
-def normalize_string(s):
-    return unidecode.unidecode(s).lower() if isinstance(s, str) else s
-
-# Function to calculate time series and category spendings
+# Function to calculate time series and category spendings.
+# The dates are grouped as real dates, so the series is in chronological order.
 def calcular_graficos(df):
-    serie_temporal = df.groupby("Fecha")["Importe"].sum().reset_index()
-    gasto_categoria = df.groupby("Clasificación")["Importe"].sum().reset_index()
+    serie_temporal = df["Importe"].groupby(charts.parse_fechas(df["Fecha"]).rename("Fecha")).sum().reset_index()
+    serie_temporal["Fecha"] = serie_temporal["Fecha"].dt.strftime("%d/%m/%Y")
+    gasto_categoria = df.groupby("Clasificación", observed=True)["Importe"].sum().reset_index()
     return serie_temporal, gasto_categoria
 
-# JWT Token Verification and Current User Retrieval
+# JWT Token Verification and Current User Retrieval.
+# Verified tokens are cached for a short time so authenticated requests skip the JWT
+# decoding and the database lookup. The cached user is a copy detached from any session.
 async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
+    cached = token_cache.get(token)
+    if cached is not None:
+        return cached
     credentials_exception = HTTPException(status_code=401, detail="Invalid authentication credentials")
-    try:
-        payload = jwt.decode(token, security.SECRET_KEY, algorithms=[security.ALGORITHM])
-        name: str = payload.get("sub")
-        if name is None:
-            raise credentials_exception
-    except JWTError:
+    payload = security.decode_access_token(token)
+    name: str = payload.get("sub") if payload else None
+    if name is None:
         raise credentials_exception
     user = await auth.get_user_by_username(db, username=name)
     if user is None:
         raise credentials_exception
+    user = models.User(name=user.name, email=user.email, hashed_password=user.hashed_password)
+    token_cache.put(token, user, payload.get("exp"))
     return user
 
 # Signup Endpoint
@@ -72,7 +120,10 @@ async def signup(user: schemas.UserCreate, db: AsyncSession = Depends(get_db)):
     db_user = await auth.get_user_by_username(db, user.name)
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
-    return await auth.create_user(db, user)
+    db_user = await auth.create_user(db, user)
+    # Tokens cached for a previous account with the same name must not be reused
+    token_cache.invalidate_user(db_user.name)
+    return db_user
 
 
 # Login Endpoint
@@ -84,6 +135,11 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSessi
     access_token = security.create_access_token(data={"sub": user.name})
     return {"access_token": access_token, "token_type": "bearer"}
 
+# Hit rate of the authentication cache
+@app.get("/auth/cache/")
+async def get_auth_cache_stats(current_user: models.User = Depends(get_current_user)):
+    return token_cache.stats()
+
 # Protected Route Example
 @app.get("/users/me/")
 async def read_users_me(current_user: models.User = Depends(get_current_user)):
@@ -91,61 +147,178 @@ async def read_users_me(current_user: models.User = Depends(get_current_user)):
 
 # Endpoint para subir archivos PDF y CSV
 @app.post("/upload/")
-async def upload_files(files: List[UploadFile] = File(None), csv: UploadFile = File(None), current_user: models.User = Depends(get_current_user)):
-    dataframes = []
-
-    # Process PDF files
-    if files:
-        for file in files:
-            contents = await file.read()
-            text = extract_text_from_pdf(io.BytesIO(contents))
-            if text:
-                df = process_ticket(text)
-                df['Clasificación'] = df['Clasificación'].apply(normalize_string)
-                dataframes.append(df)
-
-    # Procesa el CSV y clasifica los productos
-    if csv:
-        csv_contents = await csv.read()
-        csv_str = io.StringIO(csv_contents.decode('utf-8'))
-        df_csv = pd.read_csv(csv_str)
-    
-        df_csv['Clasificación'] = df_csv['Descripción'].apply(clasificar_producto)
-        df_csv['Clasificación'] = df_csv['Clasificación'].apply(normalize_string)
-        dataframes.append(df_csv)
-
-    if dataframes:
-        df_final = pd.concat(dataframes, ignore_index=True)
-        df_final.fillna(0, inplace=True)
-
-        serie_temporal, gasto_categoria = calcular_graficos(df_final)
-
-        return {
-            "tickets": df_final.to_dict(orient="records"),
-            "serie_temporal": serie_temporal.to_dict(orient="records"),
-            "gasto_categoria": gasto_categoria.to_dict(orient="records")
-        }
-
-    else:
-        return {"error": "Please upload at least one PDF or CSV file"}
-
-# Rutas CRUD para manejar clasificaciones y palabras clave
+# Without `limit` and with the default format the whole result is returned as before.
+# Otherwise the result is kept in memory and only its first page is returned;
+# the rest is read with GET /upload/resultados/ and the cursor of each page.
+async def upload_files(
+    files: List[UploadFile] = File(None),
+    csv: UploadFile = File(None),
+    formato: str = "records",
+    limit: Optional[int] = Query(None, ge=1, le=ticket_pages.PAGINA_MAX),
+    graficos: bool = True,
+    current_user: models.User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    upload_limits.check_file_count(len(files or []) + (1 if csv else 0))
+    with metrics.UPLOAD_SECONDS.time():
+        ticket_pages.validar_formato(formato)
+        clasificador = await get_user_classifier(db, current_user.name)
+        fuentes = []  # (file hash, DataFrame) for every processed file
+
+        # Process PDF files (cached tickets skip PyPDF2, new ones go to the worker pool)
+        if files:
+            fuentes.extend(await procesar_pdfs([file.file for file in files], clasificador))
+
+        # Procesa el CSV y clasifica los productos sin copiarlo entero en memoria
+        if csv:
+            with metrics.UPLOAD_STAGE_SECONDS.time(stage="hash"):
+                clave = await run_in_threadpool(hash_file, csv.file)
+            fuentes.append((clave, await run_in_threadpool(procesar_csv, csv.file, clasificador)))
+
+        if fuentes:
+            # Store the lines so the charts can be served later without re-uploading
+            with metrics.UPLOAD_STAGE_SECONDS.time(stage="store"):
+                await tickets.add_ticket_lines(db, current_user.name, fuentes)
+
+            df_final = combinar([df for _, df in fuentes])
+
+            with metrics.UPLOAD_STAGE_SECONDS.time(stage="charts"):
+                serie_temporal, gasto_categoria = calcular_graficos(df_final)
+
+            if limit is not None or formato != "records":
+                extra = {}
+                if graficos:
+                    extra = {
+                        "serie_temporal": serie_temporal.to_dict(orient="records"),
+                        "gasto_categoria": gasto_categoria.to_dict(orient="records"),
+                    }
+                resultado_id = ticket_pages.resultados.put(current_user.name, df_final)
+                with metrics.UPLOAD_STAGE_SECONDS.time(stage="serialize"):
+                    return ticket_pages.pagina(df_final, resultado_id, 0, limit, formato, extra)
+
+            # The records are already plain Python values, so they are rendered here (and timed)
+            # instead of going through FastAPI's generic encoder after returning
+            with metrics.UPLOAD_STAGE_SECONDS.time(stage="serialize"):
+                return JSONResponse({
+                    "tickets": df_final.to_dict(orient="records"),
+                    "serie_temporal": serie_temporal.to_dict(orient="records"),
+                    "gasto_categoria": gasto_categoria.to_dict(orient="records")
+                })
+
+        else:
+            return {"error": "Please upload at least one PDF or CSV file"}
+
+# Next pages of an upload result
+@app.get("/upload/resultados/")
+async def get_upload_page(cursor: str, limit: Optional[int] = Query(None, ge=1, le=ticket_pages.PAGINA_MAX), formato: str = "records", current_user: models.User = Depends(get_current_user)):
+    ticket_pages.validar_formato(formato)
+    resultado_id, offset = ticket_pages.decode_cursor(cursor)
+    df_final = ticket_pages.resultados.get(resultado_id, current_user.name)
+    if df_final is None:
+        raise HTTPException(status_code=404, detail="Result not found or expired, please upload the files again")
+    return ticket_pages.pagina(df_final, resultado_id, offset, limit, formato)
+
+# Upload processed in the background: answers at once with the id of the job.
+# Progress and the tickets processed so far are read with GET /jobs/{job_id}.
+@app.post("/jobs/", status_code=202)
+async def create_ingestion_job(
+    files: List[UploadFile] = File(None),
+    csv: UploadFile = File(None),
+    current_user: models.User = Depends(get_current_user),
+):
+    if not files and not csv:
+        raise HTTPException(status_code=400, detail="Please upload at least one PDF or CSV file")
+    upload_limits.check_file_count(len(files or []) + (1 if csv else 0))
+    trabajo = await ingestion.submit(current_user.name, [file.file for file in files or []], csv.file if csv else None)
+    return trabajo.progreso()
+
+# Status of an ingestion job. With `limit` (or a `cursor` from a previous call) the response
+# also includes a page of the tickets processed so far, as in /upload/.
+@app.get("/jobs/{job_id}")
+async def get_ingestion_job(
+    job_id: str,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=ticket_pages.PAGINA_MAX),
+    formato: str = "records",
+    current_user: models.User = Depends(get_current_user),
+):
+    trabajo = ingestion.get_job(job_id, current_user.name)
+    if trabajo is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    if cursor is None and limit is None:
+        return trabajo.progreso()
+    ticket_pages.validar_formato(formato)
+    offset = 0
+    if cursor is not None:
+        resultado_id, offset = ticket_pages.decode_cursor(cursor)
+        if resultado_id != job_id:
+            raise HTTPException(status_code=400, detail="Cursor no válido")
+    df_parcial = trabajo.resultado()
+    if df_parcial is None:
+        import pandas as pd
+        df_parcial = pd.DataFrame()
+    return ticket_pages.pagina(df_parcial, job_id, offset, limit, formato, trabajo.progreso())
+
+# Prometheus metrics of this process (disabled with METRICS_ENABLED=false)
+if metrics.METRICS_ENABLED:
+    @app.get("/metrics", response_class=PlainTextResponse)
+    async def get_metrics():
+        return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+# Charts computed in the database from the stored ticket lines
+@app.get("/tickets/serie_temporal/")
+async def get_serie_temporal(current_user: models.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    return await tickets.get_serie_temporal(db, current_user.name)
+
+@app.get("/tickets/gasto_categoria/")
+async def get_gasto_categoria(current_user: models.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    return await tickets.get_gasto_categoria(db, current_user.name)
+
+# Charts over a date range (`from`/`to`, YYYY-MM-DD, both included) at day, week or month
+# granularity, with the spending of each category per period. Computed from the daily
+# totals per category, so the cost depends on the days in the range, not on the lines.
+@app.get("/tickets/graficos/")
+async def get_graficos(
+    desde: Optional[datetime.date] = Query(None, alias="from"),
+    hasta: Optional[datetime.date] = Query(None, alias="to"),
+    granularidad: str = "day",
+    current_user: models.User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    charts.validar_granularidad(granularidad)
+    if desde is not None and hasta is not None and desde > hasta:
+        raise HTTPException(status_code=400, detail="La fecha 'from' es posterior a 'to'")
+    filas = await tickets.get_gasto_diario_categoria(db, current_user.name, desde, hasta)
+    graficos = await run_in_threadpool(charts.agregar, filas, granularidad)
+    return {"from": desde, "to": hasta, "granularidad": granularidad, **graficos}
+
+@app.get("/tickets/gasto_mensual/")
+async def get_gasto_mensual(current_user: models.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    return await tickets.get_gasto_mensual(db, current_user.name)
+
+# Rutas CRUD para manejar clasificaciones y palabras clave (cada usuario tiene las suyas)
 @app.get("/clasificaciones/")
-def get_classifications(current_user: models.User = Depends(get_current_user)):
-    return get_all_classifications()
+async def get_classifications(current_user: models.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    return await get_all_classifications(db, current_user.name)
+
+# Progreso de la reclasificación de los tickets guardados tras el último cambio de reglas
+@app.get("/clasificaciones/reclasificacion/")
+async def get_reclassification_progress(current_user: models.User = Depends(get_current_user)):
+    progreso = reclassification.get_progress(current_user.name)
+    return progreso or {"estado": "sin_trabajos"}
 
 @app.post("/clasificaciones/")
-def add_new_classification(data: ClassificationInput, current_user: models.User = Depends(get_current_user)):
-    return add_classification(data.name, data.keywords)
+async def add_new_classification(data: ClassificationInput, current_user: models.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    return await add_classification(db, current_user.name, data.name, data.keywords)
 
 @app.delete("/clasificaciones/{name}")
-def remove_classification(name: str, current_user: models.User = Depends(get_current_user)):
-    return delete_classification(name)
+async def remove_classification(name: str, current_user: models.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    return await delete_classification(db, current_user.name, name)
 
 @app.post("/clasificaciones/{name}/keywords/")
-def add_new_keyword(name: str, keyword: str, current_user: models.User = Depends(get_current_user)):
-    return add_keyword(name, keyword)
+async def add_new_keyword(name: str, keyword: str, current_user: models.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    return await add_keyword(db, current_user.name, name, keyword)
 
 @app.delete("/clasificaciones/{name}/keywords/{keyword}")
-def remove_keyword(name: str, keyword: str, current_user: models.User = Depends(get_current_user)):
-    return delete_keyword(name, keyword)
\ No newline at end of file
+async def remove_keyword(name: str, keyword: str, current_user: models.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    return await delete_keyword(db, current_user.name, name, keyword)
@@ -0,0 +1,142 @@
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Con METRICS_ENABLED=false las métricas no se registran (cada llamada vuelve de inmediato)
+# y /metrics no existe
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Límites de los buckets de duración, en segundos (los mismos que usa Prometheus por defecto)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registro = []
+
+
+def _etiquetas(nombres, valores):
+    if not nombres:
+        return ""
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(nombres, valores)) + "}"
+
+
+class Counter:
+    """Contador acumulado, opcionalmente con etiquetas"""
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._valores = {}
+        _registro.append(self)
+
+    def inc(self, valor=1, **labels):
+        if not METRICS_ENABLED or not valor:
+            return
+        clave = tuple(labels[n] for n in self.labels)
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0) + valor
+
+    def render(self):
+        lineas = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            valores = sorted(self._valores.items())
+        lineas += [f"{self.name}{_etiquetas(self.labels, clave)} {valor}" for clave, valor in valores]
+        return lineas
+
+
+class Histogram:
+    """Histograma de duraciones con buckets fijos, opcionalmente con etiquetas"""
+
+    def __init__(self, name, documentation, labels=(), buckets=BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}  # etiquetas -> [conteo por bucket (el último es +Inf)..., suma, total]
+        _registro.append(self)
+
+    def observe(self, valor, **labels):
+        if not METRICS_ENABLED:
+            return
+        clave = tuple(labels[n] for n in self.labels)
+        indice = bisect.bisect_left(self.buckets, valor)
+        with self._lock:
+            serie = self._series.get(clave)
+            if serie is None:
+                serie = self._series[clave] = [0] * (len(self.buckets) + 3)
+            serie[indice] += 1
+            serie[-2] += valor
+            serie[-1] += 1
+
+    @contextmanager
+    def _medir(self, labels):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - inicio, **labels)
+
+    def time(self, **labels):
+        """Context manager que observa la duración del bloque"""
+        if not METRICS_ENABLED:
+            return _NADA
+        return self._medir(labels)
+
+    def render(self):
+        lineas = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((clave, list(serie)) for clave, serie in self._series.items())
+        for clave, serie in series:
+            acumulado = 0
+            for le, conteo in zip([repr(b) for b in self.buckets] + ["+Inf"], serie[:-2]):
+                acumulado += conteo
+                lineas.append(f"{self.name}_bucket{_etiquetas(self.labels + ('le',), clave + (le,))} {acumulado}")
+            lineas.append(f"{self.name}_sum{_etiquetas(self.labels, clave)} {serie[-2]}")
+            lineas.append(f"{self.name}_count{_etiquetas(self.labels, clave)} {serie[-1]}")
+        return lineas
+
+
+class _SinMedida:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NADA = _SinMedida()
+
+
+def render():
+    """Todas las métricas en el formato de texto de Prometheus"""
+    lineas = []
+    for metrica in _registro:
+        lineas += metrica.render()
+    return "\n".join(lineas) + "\n"
+
+
+# Métricas de la aplicación (por proceso: con varios workers de uvicorn, cada uno expone las suyas)
+UPLOAD_STAGE_SECONDS = Histogram(
+    "upload_stage_duration_seconds",
+    "Duration of each stage of an upload (hash, pdf_extract, ticket_parse, csv_read, classify, store, combine, charts, serialize)",
+    labels=("stage",),
+)
+UPLOAD_SECONDS = Histogram("upload_duration_seconds", "Total duration of /upload/ requests")
+UPLOAD_PDFS = Counter("upload_pdfs_total", "Uploaded PDFs by result (parsed, cached, unreadable)", labels=("result",))
+UPLOAD_TICKET_LINES = Counter("upload_ticket_lines_total", "Product lines read from uploaded PDFs")
+UPLOAD_CSV_ROWS = Counter("upload_csv_rows_total", "Rows read from uploaded CSV files")
+UPLOAD_REJECTED = Counter(
+    "upload_rejected_total",
+    "Uploads rejected by a limit (rate_limited, too_large, too_many_files, too_many_rows)",
+    labels=("reason",),
+)
+CLASSIFIER_CACHE = Counter("classifier_cache_lookups_total", "Description -> category cache lookups by result (hit, miss)", labels=("result",))
+CLASSIFICATION_SECONDS = Histogram(
+    "classification_operation_duration_seconds",
+    "Duration of classification rule operations",
+    labels=("operation",),
+)
+CLASSIFICATION_CONFLICTS = Counter("classification_rule_conflicts_total", "Rule saves retried because of a concurrent change")
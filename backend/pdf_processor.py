@@ -1,26 +1,14 @@
-import PyPDF2
+import io
 import re
-import pandas as pd
-import json
-import os
-
-# Cargar clasificaciones desde un archivo JSON
-CLASSIFICATIONS_FILE = "clasificaciones.json"
-
-def load_classifications():
-    """
-    Cargar las clasificaciones desde el archivo JSON. Si el archivo no existe, devuelve un diccionario vacío.
-    """
-    if os.path.exists(CLASSIFICATIONS_FILE):
-        with open(CLASSIFICATIONS_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f).get('clasificaciones', {})
-    return {}
+import time
+from classifier import get_classifier
 
 # Función para extraer el texto de un archivo PDF usando PyPDF2
 def extract_text_from_pdf(pdf_file):
     """
     Extraer el texto de un archivo PDF utilizando PyPDF2.
     """
+    import PyPDF2
     try:
         reader = PyPDF2.PdfReader(pdf_file)
         text = ''
@@ -35,70 +23,122 @@ def extract_text_from_pdf(pdf_file):
 def clasificar_producto(descripcion):
     """
     Clasificar los productos según las palabras clave en el archivo JSON de clasificaciones.
+    Las reglas se cargan una sola vez y se recompilan solo cuando cambian.
     Si ninguna palabra clave coincide, devuelve 'Otros'.
     """
-    clasificaciones = load_classifications()
-    descripcion = descripcion.lower()  # Convertir a minúsculas para facilitar la comparación
-    
-    # Buscar la categoría correspondiente en función de las palabras clave
-    for categoria, palabras_clave in clasificaciones.items():
-        if any(palabra in descripcion for palabra in palabras_clave):
-            return categoria
-    return 'Otros'  # Si no coincide ninguna palabra clave, devolver 'Otros'
+    return get_classifier().classify(descripcion)
 
-# Función para procesar el texto de un ticket y devolver los productos en un DataFrame
-def process_ticket(text):
+# Versión del parser: al cambiarla, los tickets guardados en caché se vuelven a procesar
+PARSER_VERSION = 3
+
+# Expresiones precompiladas del parser de tickets
+# Marcas de estructura del ticket: fecha y hora, cabecera de la sección de productos y total
+MARCA_RE = re.compile(
+    r"(?P<fecha_hora>(?P<fecha>\d{2}/\d{2}/\d{4}) (?P<hora>\d{2}:\d{2}))"
+    r"|(?P<cabecera>Descripción P\. Unit Importe)"
+    r"|(?P<total>TOTAL)"
+)
+# Línea de producto: [unidades] descripción [precio unitario] importe.
+# La descripción avanza palabra a palabra (no carácter a carácter) hasta dar con los precios finales
+PRODUCTO_RE = re.compile(
+    r"(?:(?P<num>\d+)\s*)?(?P<descripcion>\S+(?:\s+\S+)*?)\s+(?:(?P<p_unit>\d+,\d{2})\s+)?(?P<importe>\d+,\d{2})\s*$"
+)
+# Segunda línea de un producto a peso: "1,026 kg 1,99 €/kg 2,04"
+PESO_RE = re.compile(r"(?P<peso>\d+,\d{3})\s*kg\s+(?P<p_unit>\d+,\d{2})\s*€/kg\s+(?P<importe>\d+,\d{2})\s*$")
+# Primera línea de un producto que continúa en la siguiente (a peso o con el nombre partido)
+SIN_IMPORTE_RE = re.compile(r"(?P<num>\d+)\s*(?P<descripcion>\S.*?)\s*$")
+
+def _precio(valor):
+    return float(valor.replace(",", ".")) if valor else None
+
+# Función para extraer las líneas de producto de un ticket, sin clasificarlas
+def parse_ticket(text):
     """
     Procesar el texto extraído de un ticket y devolver los productos en un DataFrame.
-    El DataFrame incluye el número de artículos, descripción, precio unitario, importe total, fecha, hora y clasificación.
+    El DataFrame incluye el número de artículos, descripción, precio unitario, importe total, fecha y hora.
+
+    Cada línea se reconoce con una sola pasada de una expresión precompilada. Los productos
+    a peso (nombre en una línea y "peso kg precio €/kg importe" en la siguiente) usan el precio
+    por kilo como precio unitario, y los nombres partidos en dos líneas se unen.
     """
-    lines = text.split("\n")  # Dividir el texto del ticket en líneas
-    
     productos = []  # Lista para almacenar los productos
     fecha, hora = None, None  # Variables para almacenar la fecha y hora
     procesando_productos = False
+    pendiente = None  # (unidades, descripción) de un producto que sigue en la línea siguiente
 
-    # Recorremos las líneas del texto
-    for line in lines:
-        # Verificamos si la línea contiene la fecha y hora del ticket
-        if re.search(r"\d{2}/\d{2}/\d{4} \d{2}:\d{2}", line):
-            fecha_hora = re.search(r"(\d{2}/\d{2}/\d{4}) (\d{2}:\d{2})", line)
-            if fecha_hora:
-                fecha = fecha_hora.group(1)
-                hora = fecha_hora.group(2)
+    for line in text.split("\n"):
+        if not procesando_productos:
+            marca = MARCA_RE.search(line)
+            if marca:
+                tipo = marca.lastgroup
+                if tipo == "fecha_hora":
+                    fecha, hora = marca.group("fecha"), marca.group("hora")
+                elif tipo == "cabecera":
+                    procesando_productos = True
+                else:
+                    break  # TOTAL antes de la sección de productos
             continue
 
-        # Verificamos si encontramos la línea que marca el inicio de la sección de productos
-        if "Descripción P. Unit Importe" in line:
-            procesando_productos = True
-            continue  # Saltamos a la siguiente línea, que ya será un producto
-
-        # Si encontramos "TOTAL", dejamos de procesar productos
+        # Dentro de la sección de productos solo puede aparecer el TOTAL que la cierra
         if "TOTAL" in line:
-            procesando_productos = False
             break
 
-        # Si estamos en la sección de productos, procesamos las líneas de productos
-        if procesando_productos:
-            # Extraer el precio unitario y el importe total usando expresiones regulares
-            match = re.findall(r"(\d+,\d{2})", line)
-            if len(match) >= 1:
-                importe = match[-1].replace(",", ".")
-                p_unit = match[-2].replace(",", ".") if len(match) >= 2 else None
-                num_articulos = re.match(r"(\d+)", line).group(1)
-                descripcion = re.sub(r"^\d+\s*", "", line).rsplit(match[-1], 1)[0].strip()
+        if pendiente:
+            num, descripcion = pendiente
+            pendiente = None
+            peso = PESO_RE.match(line)
+            if peso:
+                productos.append((num, descripcion, _precio(peso.group("p_unit")), _precio(peso.group("importe")), fecha, hora))
+                continue
+            producto = PRODUCTO_RE.match(line)
+            if producto and (producto.group("num") is None or producto.group("p_unit") is None):
+                # Resto del nombre de un producto partido en dos líneas. Puede empezar por un
+                # número ("1 PIZZA" + "4 QUESOS 3,50"): sin precio unitario no son unidades
+                resto = line[:producto.start("p_unit" if producto.group("p_unit") else "importe")].strip()
+                productos.append((num, f"{descripcion} {resto}", _precio(producto.group("p_unit")),
+                                  _precio(producto.group("importe")), fecha, hora))
+                continue
 
-                # Clasificar el producto usando el archivo JSON
-                clasificacion = clasificar_producto(descripcion)
+        producto = PRODUCTO_RE.match(line)
+        if producto:
+            if producto.group("num") is not None:
+                productos.append((int(producto.group("num")), producto.group("descripcion"), _precio(producto.group("p_unit")),
+                                  _precio(producto.group("importe")), fecha, hora))
+            continue
 
-                try:
-                    # Añadir el producto a la lista
-                    productos.append((int(num_articulos), descripcion, float(p_unit) if p_unit else None, 
-                                      float(importe), fecha, hora, clasificacion))
-                except ValueError:
-                    print(f"Error al convertir a float: {p_unit}, {importe}")
-                    continue  # Si hay un error, pasamos a la siguiente línea
+        sin_importe = SIN_IMPORTE_RE.match(line)
+        if sin_importe:
+            pendiente = (int(sin_importe.group("num")), sin_importe.group("descripcion"))
 
     # Convertimos los productos a un DataFrame
-    df = pd.DataFrame(productos, columns=["Número de artículos", "Descripción", "P. Unit", "Importe", "Fecha", "Hora", "Clasificación"])
+    import pandas as pd
+    df = pd.DataFrame(productos, columns=["Número de artículos", "Descripción", "P. Unit", "Importe", "Fecha", "Hora"])
+    return df
+
+# Función para procesar el texto de un ticket y devolver los productos clasificados en un DataFrame
+def process_ticket(text):
+    """
+    Procesar el texto extraído de un ticket y devolver los productos en un DataFrame.
+    El DataFrame incluye el número de artículos, descripción, precio unitario, importe total, fecha, hora y clasificación.
+    """
+    df = parse_ticket(text)
+    df["Clasificación"] = df["Descripción"].apply(clasificar_producto)
+    return df
+
+# Función que ejecutan los procesos del pool: del PDF a las líneas sin clasificar
+def parse_pdf(pdf_file):
+    """
+    Extraer y procesar un PDF recibido como bytes o como fichero abierto. Devuelve None si no se pudo leer.
+    La clasificación se hace en el proceso principal, que es el que conoce las reglas vigentes.
+    Lo que tardó cada fase queda en df.attrs["tiempos"], porque puede ejecutarse en otro proceso.
+    """
+    if isinstance(pdf_file, bytes):
+        pdf_file = io.BytesIO(pdf_file)
+    inicio = time.perf_counter()
+    text = extract_text_from_pdf(pdf_file)
+    if not text:
+        return None
+    extraido = time.perf_counter()
+    df = parse_ticket(text)
+    df.attrs["tiempos"] = {"pdf_extract": extraido - inicio, "ticket_parse": time.perf_counter() - extraido}
     return df
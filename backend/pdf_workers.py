@@ -0,0 +1,55 @@
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from starlette.concurrency import run_in_threadpool
+
+from pdf_processor import parse_pdf
+
+# Número de procesos para leer PDFs (0 = sin pool, se usa el threadpool de Starlette)
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", os.cpu_count() or 1))
+# Tareas que atiende cada proceso antes de reemplazarlo (0 = sin límite)
+PDF_WORKER_MAX_TASKS = int(os.getenv("PDF_WORKER_MAX_TASKS", "100")) or None
+
+_pool = None
+
+
+# Crear el pool la primera vez que se necesita
+def get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=PDF_WORKERS, max_tasks_per_child=PDF_WORKER_MAX_TASKS)
+    return _pool
+
+
+# Cerrar el pool (se llama al apagar la aplicación)
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
+
+
+async def parse_pdfs(ficheros):
+    """
+    Procesar varios PDFs (ficheros abiertos) en paralelo sin bloquear el bucle de eventos.
+    Devuelve un DataFrame (o None si el PDF no se pudo leer) por PDF, en el mismo orden de subida.
+    """
+    if PDF_WORKERS <= 0:
+        # Sin pool, PyPDF2 lee directamente del fichero temporal de la subida
+        return await asyncio.gather(*(run_in_threadpool(parse_pdf, fichero) for fichero in ficheros))
+
+    # Los procesos del pool necesitan los bytes: cada PDF se lee justo antes de enviarlo
+    loop = asyncio.get_running_loop()
+    pool = get_pool()
+    futuros = []
+    for fichero in ficheros:
+        contents = await run_in_threadpool(fichero.read)
+        futuros.append(loop.run_in_executor(pool, parse_pdf, contents))
+    try:
+        return await asyncio.gather(*futuros)
+    except BrokenProcessPool:
+        # Un proceso murió (p. ej. por memoria); se descarta el pool para recrearlo en la siguiente subida
+        shutdown_pool()
+        raise
@@ -0,0 +1,188 @@
+import asyncio
+import logging
+import os
+import time
+
+from classification_manager import get_rules_version, subscribe
+from classifier import ALGORITHM_VERSION, changed_keywords, get_user_classifier, keyword_matcher
+from users import settings, spend, tickets
+from users.db import async_session
+
+logger = logging.getLogger(__name__)
+
+# Descripciones distintas que se revisan por lote (cada lote es una transacción)
+RECLASIFICACION_LOTE = int(os.getenv("RECLASSIFY_BATCH_SIZE", "2000"))
+
+
+class ReclassificationJob:
+    """
+    Trabajo en segundo plano que reclasifica las líneas de ticket guardadas de un usuario
+    cuando cambian sus reglas.
+
+    Solo se revisan las descripciones que contienen alguna palabra clave cambiada (todas si
+    lo que cambia es el algoritmo de clasificación); se recorren por lotes, cada uno en su
+    propia transacción, para no bloquear la base de datos ni el bucle de eventos. Si las
+    reglas vuelven a cambiar mientras se ejecuta, los cambios se acumulan y se hace otra
+    pasada con ellos al terminar la actual.
+    """
+
+    def __init__(self, user_name):
+        self.user_name = user_name
+        self.version = 0
+        self.estado = "pendiente"
+        self.pasadas = 0
+        self.lotes = 0
+        self.total_descripciones = 0
+        self.descripciones_revisadas = 0
+        self.descripciones_afectadas = 0
+        self.lineas_reclasificadas = 0
+        self.iniciado = None
+        self.terminado = None
+        self.error = None
+        self._pendientes = set()
+        self._todas = False
+        self._tarea = None
+
+    def programar(self, version, cambiadas):
+        """Reclasificar las descripciones con las palabras clave `cambiadas` (None: todas)"""
+        self.version = max(self.version, version)
+        if cambiadas is None:
+            self._todas = True
+        else:
+            self._pendientes |= cambiadas
+        if self._tarea is None or self._tarea.done():
+            self.estado = "pendiente"
+            self.terminado = None
+            self.error = None
+            self._tarea = asyncio.get_running_loop().create_task(self._ejecutar())
+
+    async def _ejecutar(self):
+        self.estado = "en_curso"
+        self.iniciado = time.time()
+        try:
+            while self._todas or self._pendientes:
+                if self._todas:
+                    # Una pasada por todas las descripciones cubre también los cambios acumulados
+                    self._todas, self._pendientes = False, set()
+                    await self._pasada(None)
+                    continue
+                cambiadas, self._pendientes = self._pendientes, set()
+                afectada = keyword_matcher(cambiadas)
+                if afectada:
+                    await self._pasada(afectada)
+            self.estado = "completado"
+        except asyncio.CancelledError:
+            self.estado = "cancelado"
+            raise
+        except Exception as exc:
+            logger.exception("Reclassification of %s failed", self.user_name)
+            self.estado = "error"
+            self.error = str(exc)
+        finally:
+            self.terminado = time.time()
+
+    async def _pasada(self, afectada):
+        import pandas as pd
+        self.pasadas += 1
+        async with async_session() as db:
+            self.total_descripciones = await tickets.count_descriptions(db, self.user_name)
+        self.descripciones_revisadas = 0
+        ultima = ""
+        while True:
+            async with async_session() as db:
+                # Se pide el clasificador en cada lote para usar siempre las reglas más recientes
+                clasificador = await get_user_classifier(db, self.user_name)
+                descripciones = await tickets.get_descriptions_page(db, self.user_name, ultima, RECLASIFICACION_LOTE)
+                if not descripciones:
+                    return
+                ultima = descripciones[-1]
+                afectadas = [d for d in descripciones if afectada is None or afectada(d)]
+                if afectadas:
+                    nuevas = clasificador.classify_many(pd.Series(afectadas)).astype(str)
+                    self.lineas_reclasificadas += await spend.reclassify_lines(
+                        db, self.user_name, dict(zip(afectadas, nuevas))
+                    )
+            self.lotes += 1
+            self.descripciones_revisadas += len(descripciones)
+            self.descripciones_afectadas += len(afectadas)
+            await asyncio.sleep(0)  # Dejar paso a las peticiones entre lotes
+
+    def progreso(self):
+        return {
+            "estado": self.estado,
+            "version": self.version,
+            "pasadas": self.pasadas,
+            "lotes": self.lotes,
+            "total_descripciones": self.total_descripciones,
+            "descripciones_revisadas": self.descripciones_revisadas,
+            "descripciones_afectadas": self.descripciones_afectadas,
+            "lineas_reclasificadas": self.lineas_reclasificadas,
+            "iniciado": self.iniciado,
+            "terminado": self.terminado,
+            "error": self.error,
+        }
+
+
+# Último trabajo de cada usuario: usuario -> ReclassificationJob
+_trabajos = {}
+
+
+def _programar(user_name, version, cambiadas):
+    trabajo = _trabajos.get(user_name)
+    if trabajo is None or trabajo.estado not in ("pendiente", "en_curso"):
+        trabajo = ReclassificationJob(user_name)
+        _trabajos[user_name] = trabajo
+    trabajo.programar(version, cambiadas)
+
+
+def _on_rules_changed(user_name, version, clasificaciones, anteriores):
+    cambiadas = changed_keywords(anteriores, clasificaciones)
+    if not cambiadas:
+        return  # El cambio no puede mover ninguna línea (p. ej. una categoría vacía)
+    _programar(user_name, version, cambiadas)
+
+
+# Clave de AppSetting con la versión del algoritmo con la que están clasificadas las líneas guardadas
+CLAVE_VERSION_ALGORITMO = "classifier_algorithm_version"
+
+
+async def ensure_algorithm_version(db):
+    """
+    Al arrancar: si las líneas guardadas se clasificaron con otra versión del algoritmo
+    (o con una anterior a que se guardara la versión), programar la reclasificación de
+    todas las descripciones de cada usuario con tickets.
+    """
+    anterior = await settings.get_setting(db, CLAVE_VERSION_ALGORITMO)
+    if anterior == str(ALGORITHM_VERSION):
+        return
+    usuarios = await tickets.get_users_with_tickets(db)
+    # Con varios procesos arrancando a la vez, solo el que cambia la versión programa las reclasificaciones
+    if not await settings.compare_and_set_setting(db, CLAVE_VERSION_ALGORITMO, anterior, str(ALGORITHM_VERSION)):
+        return
+    await db.commit()
+    for user_name in usuarios:
+        _programar(user_name, await get_rules_version(db, user_name), None)
+    if usuarios:
+        logger.info("Classifier algorithm changed to version %s: reclassifying %d users", ALGORITHM_VERSION, len(usuarios))
+
+
+def get_progress(user_name):
+    """
+    Progreso del último trabajo de reclasificación del usuario, o None si no ha habido ninguno.
+    """
+    trabajo = _trabajos.get(user_name)
+    return trabajo.progreso() if trabajo else None
+
+
+async def shutdown():
+    """
+    Cancelar los trabajos en curso (al parar el servidor).
+    """
+    tareas = [t._tarea for t in _trabajos.values() if t._tarea and not t._tarea.done()]
+    for tarea in tareas:
+        tarea.cancel()
+    await asyncio.gather(*tareas, return_exceptions=True)
+
+
+# Lanzar una reclasificación cada vez que se guarden las reglas de un usuario
+subscribe(_on_rules_changed)
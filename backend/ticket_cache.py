@@ -0,0 +1,112 @@
+import hashlib
+import io
+import os
+import sqlite3
+import threading
+import time
+
+# Fichero SQLite donde se guardan los tickets ya procesados
+TICKET_CACHE_PATH = os.getenv("TICKET_CACHE_PATH", "ticket_cache.sqlite3")
+# Tamaño máximo de la caché en MB (0 = caché desactivada)
+TICKET_CACHE_MAX_MB = float(os.getenv("TICKET_CACHE_MAX_MB", "256"))
+# Segundos que se espera a que otro proceso (otro worker de uvicorn) suelte el fichero
+TICKET_CACHE_BUSY_TIMEOUT = 30
+
+
+# Clave de un PDF en la caché: el SHA-256 de su contenido, leído por bloques
+def hash_file(fichero, bloque=1024 * 1024):
+    sha = hashlib.sha256()
+    while datos := fichero.read(bloque):
+        sha.update(datos)
+    fichero.seek(0)
+    return sha.hexdigest()
+
+
+class TicketCache:
+    """
+    Caché persistente de tickets ya procesados, direccionada por el hash del PDF.
+
+    Cada entrada guarda las líneas del ticket ya clasificadas junto con la versión
+    de las reglas usada para clasificarlas. Cuando se supera el tamaño máximo se
+    eliminan las entradas usadas hace más tiempo (LRU).
+
+    Los métodos hacen E/S bloqueante: desde código asíncrono se llaman con
+    run_in_threadpool, una vez por lote de PDFs. El fichero se abre en modo WAL para
+    que varios procesos lo puedan leer y escribir a la vez.
+    """
+
+    def __init__(self, path, max_bytes):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=TICKET_CACHE_BUSY_TIMEOUT, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS tickets ("
+            "clave TEXT PRIMARY KEY, version TEXT NOT NULL, datos TEXT NOT NULL, "
+            "tamano INTEGER NOT NULL, ultimo_acceso REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_tickets_ultimo_acceso ON tickets (ultimo_acceso)")
+        self._conn.commit()
+
+    def get_many(self, claves):
+        """
+        Devolver {clave: (versión de las reglas, DataFrame)} con los PDFs que están en caché.
+        """
+        with self._lock:
+            filas = []
+            for clave in claves:
+                fila = self._conn.execute("SELECT version, datos FROM tickets WHERE clave = ?", (clave,)).fetchone()
+                if fila is not None:
+                    filas.append((clave, *fila))
+            if filas:
+                ahora = time.time()
+                self._conn.executemany("UPDATE tickets SET ultimo_acceso = ? WHERE clave = ?", [(ahora, clave) for clave, _, _ in filas])
+                self._conn.commit()
+        if not filas:
+            return {}
+        import pandas as pd
+        return {
+            clave: (version, pd.read_json(io.StringIO(datos), orient="split", dtype=False, convert_dates=False))
+            for clave, version, datos in filas
+        }
+
+    def put_many(self, tickets, version):
+        """
+        Guardar las líneas clasificadas de varios PDFs ({clave: DataFrame}) y aplicar la
+        política de expulsión.
+        """
+        ahora = time.time()
+        filas = []
+        for clave, df in tickets.items():
+            datos = df.to_json(orient="split", index=False, force_ascii=False)
+            filas.append((clave, version, datos, len(datos), ahora))
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO tickets (clave, version, datos, tamano, ultimo_acceso) VALUES (?, ?, ?, ?, ?)",
+                filas,
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(tamano), 0) FROM tickets").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        expulsadas = []
+        for clave, tamano in self._conn.execute("SELECT clave, tamano FROM tickets ORDER BY ultimo_acceso"):
+            if total <= self.max_bytes:
+                break
+            expulsadas.append((clave,))
+            total -= tamano
+        self._conn.executemany("DELETE FROM tickets WHERE clave = ?", expulsadas)
+
+
+_cache = None
+
+
+# Abrir la caché la primera vez que se usa. Devuelve None si está desactivada.
+def get_cache():
+    global _cache
+    if _cache is None and TICKET_CACHE_MAX_MB > 0:
+        _cache = TicketCache(TICKET_CACHE_PATH, int(TICKET_CACHE_MAX_MB * 1024 * 1024))
+    return _cache
@@ -0,0 +1,123 @@
+import base64
+import io
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from fastapi import HTTPException, Response
+
+# Formatos de respuesta soportados para la lista de tickets
+FORMATOS = ("records", "columnas", "arrow", "parquet")
+# Resultados de subida guardados para paginarlos y cuánto tiempo se guardan (segundos)
+RESULTADOS_MAX = int(os.getenv("UPLOAD_RESULTS_MAX", "64"))
+RESULTADOS_TTL = float(os.getenv("UPLOAD_RESULTS_TTL", "900"))
+# Filas máximas de una página (parámetro `limit`)
+PAGINA_MAX = int(os.getenv("UPLOAD_PAGE_MAX", "100000"))
+
+
+class ResultStore:
+    """
+    Almacén en memoria (LRU con caducidad) de los DataFrames de las últimas subidas,
+    para poder servir sus páginas siguientes sin volver a procesar los ficheros.
+    """
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._resultados = OrderedDict()
+
+    def put(self, user_name, df):
+        resultado_id = uuid.uuid4().hex
+        with self._lock:
+            self._resultados[resultado_id] = (user_name, df, time.monotonic() + self.ttl)
+            while len(self._resultados) > self.max_entries:
+                self._resultados.popitem(last=False)
+        return resultado_id
+
+    def get(self, resultado_id, user_name):
+        with self._lock:
+            entrada = self._resultados.get(resultado_id)
+            if entrada is None or entrada[2] < time.monotonic():
+                self._resultados.pop(resultado_id, None)
+                return None
+            self._resultados.move_to_end(resultado_id)
+        propietario, df, _ = entrada
+        return df if propietario == user_name else None
+
+
+resultados = ResultStore(RESULTADOS_MAX, RESULTADOS_TTL)
+
+
+# El cursor es opaco para el cliente: identifica el resultado y la fila donde empieza la página
+def encode_cursor(resultado_id, offset):
+    return base64.urlsafe_b64encode(f"{resultado_id}:{offset}".encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        resultado_id, offset = base64.urlsafe_b64decode(cursor.encode()).decode().split(":")
+        offset = int(offset)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cursor no válido")
+    if offset < 0:
+        raise HTTPException(status_code=400, detail="Cursor no válido")
+    return resultado_id, offset
+
+
+def validar_formato(formato):
+    if formato not in FORMATOS:
+        raise HTTPException(status_code=400, detail=f"Formato no soportado. Usa uno de: {', '.join(FORMATOS)}")
+
+
+# Serializar un DataFrame a JSON con pandas, sin pasar por el codificador genérico de FastAPI
+def _tickets_json(df, formato):
+    if formato == "records":
+        return df.to_json(orient="records", force_ascii=False)
+    # Formato columnar: un array por columna, sin repetir los nombres en cada fila
+    columnas = ",".join(
+        f"{json.dumps(columna, ensure_ascii=False)}:{df[columna].to_json(orient='values', force_ascii=False)}"
+        for columna in df.columns
+    )
+    return "{" + columnas + "}"
+
+
+def _tickets_binario(df, formato):
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise HTTPException(status_code=400, detail="Los formatos arrow y parquet necesitan pyarrow instalado")
+    buffer = io.BytesIO()
+    if formato == "parquet":
+        df.to_parquet(buffer, index=False)
+        return buffer.getvalue(), "application/vnd.apache.parquet"
+    tabla = pa.Table.from_pandas(df, preserve_index=False)
+    with pa.ipc.new_stream(buffer, tabla.schema) as writer:
+        writer.write_table(tabla)
+    return buffer.getvalue(), "application/vnd.apache.arrow.stream"
+
+
+def pagina(df, resultado_id, offset, limit, formato, extra=None):
+    """
+    Construir la respuesta con una página de tickets.
+    En JSON, el cursor de la página siguiente va en "next_cursor" junto con los datos de `extra`
+    (p. ej. los gráficos). En arrow/parquet el cuerpo es solo la tabla y el cursor va en la
+    cabecera X-Next-Cursor.
+    """
+    trozo = df.iloc[offset:offset + limit] if limit else df.iloc[offset:]
+    fin = offset + len(trozo)
+    next_cursor = encode_cursor(resultado_id, fin) if fin < len(df) else None
+
+    if formato in ("arrow", "parquet"):
+        contenido, media_type = _tickets_binario(trozo, formato)
+        headers = {"X-Total-Count": str(len(df))}
+        if next_cursor:
+            headers["X-Next-Cursor"] = next_cursor
+        return Response(content=contenido, media_type=media_type, headers=headers)
+
+    cuerpo = dict(extra or {}, next_cursor=next_cursor, total=len(df))
+    contenido = json.dumps(cuerpo, ensure_ascii=False)[:-1] + ',"tickets":' + _tickets_json(trozo, formato) + "}"
+    return Response(content=contenido, media_type="application/json")
@@ -0,0 +1,171 @@
+import math
+import os
+import time
+
+from fastapi import HTTPException
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+
+import metrics
+from users import security
+
+# Subidas (POST /upload/ y /jobs/) que recupera cada usuario por minuto (0 desactiva el límite)
+UPLOAD_RATE_PER_MINUTE = float(os.getenv("UPLOAD_RATE_PER_MINUTE", "30"))
+# Subidas seguidas que puede hacer un usuario antes de tener que esperar
+UPLOAD_RATE_BURST = int(os.getenv("UPLOAD_RATE_BURST", "10"))
+# Límites de cada subida (0 desactiva cada uno)
+UPLOAD_MAX_FILES = int(os.getenv("UPLOAD_MAX_FILES", "500"))
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(200 * 2**20)))
+UPLOAD_MAX_CSV_ROWS = int(os.getenv("UPLOAD_MAX_CSV_ROWS", "2000000"))
+
+# Rutas protegidas por el limitador y el tamaño máximo (solo peticiones POST)
+RUTAS_SUBIDA = ("/upload/", "/jobs/")
+
+
+class UploadTooLarge(HTTPException):
+    """La subida supera alguno de los límites configurados"""
+
+    def __init__(self, detail):
+        super().__init__(status_code=413, detail=detail)
+
+
+class LocalBucketStore:
+    """
+    Cubos de tokens en memoria del proceso. Expone solo `take`, de modo que se puede
+    sustituir por uno compartido entre procesos (por ejemplo, Redis con un script Lua)
+    sin tocar el limitador.
+    """
+
+    # Cubos que se guardan como mucho; al llenarse se olvidan los que ya están llenos
+    MAX_CUBOS = 100_000
+
+    def __init__(self):
+        self._cubos = {}  # clave -> (tokens, instante de la última actualización)
+
+    async def take(self, clave, capacidad, por_segundo, coste=1):
+        """
+        Sacar `coste` tokens del cubo de `clave`. Devuelve 0 si había bastantes, o los
+        segundos que faltan para que los haya (y entonces no saca ninguno).
+        """
+        # Sin await por medio: en el bucle de eventos la actualización es atómica
+        ahora = time.monotonic()
+        tokens, ultimo = self._cubos.get(clave, (capacidad, ahora))
+        tokens = min(capacidad, tokens + (ahora - ultimo) * por_segundo)
+        if tokens < coste:
+            self._cubos[clave] = (tokens, ahora)
+            return (coste - tokens) / por_segundo
+        self._cubos[clave] = (tokens - coste, ahora)
+        if len(self._cubos) > self.MAX_CUBOS:
+            self._purgar(ahora, capacidad, por_segundo)
+        return 0
+
+    def _purgar(self, ahora, capacidad, por_segundo):
+        for clave in [c for c, (t, u) in self._cubos.items() if t + (ahora - u) * por_segundo >= capacidad]:
+            del self._cubos[clave]
+
+
+class RateLimiter:
+    """Limitador de peticiones por cubo de tokens: `por_minuto` de ritmo sostenido y `rafaga` de margen"""
+
+    def __init__(self, por_minuto, rafaga, store=None):
+        self.por_segundo = por_minuto / 60
+        self.rafaga = max(1, rafaga)
+        self.store = store or LocalBucketStore()
+
+    async def consume(self, clave, coste=1):
+        """Devuelve 0 si la petición puede pasar, o los segundos que hay que esperar"""
+        return await self.store.take(clave, self.rafaga, self.por_segundo, coste)
+
+
+def _clave(scope, headers):
+    # El usuario del token si es válido (sin consultar la base de datos); si no, la IP
+    autorizacion = headers.get("authorization", "")
+    if autorizacion.lower().startswith("bearer "):
+        payload = security.decode_access_token(autorizacion[7:])
+        if payload and payload.get("sub"):
+            return f"user:{payload['sub']}"
+    cliente = scope.get("client")
+    return f"ip:{cliente[0] if cliente else 'desconocido'}"
+
+
+class UploadLimitMiddleware:
+    """
+    Aplica el límite de ritmo y el tamaño máximo a las subidas antes de leer el cuerpo:
+    FastAPI lee y guarda los ficheros de la petición antes de ejecutar el endpoint, así que
+    comprobarlo allí ya sería tarde. El número de ficheros y de filas del CSV se comprueba
+    después, en el endpoint (check_file_count) y al leer el CSV (check_csv_rows).
+    """
+
+    def __init__(self, app, rutas=RUTAS_SUBIDA, limiter=None, max_bytes=UPLOAD_MAX_BYTES):
+        self.app = app
+        self.rutas = rutas
+        self.limiter = limiter
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.rutas:
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+
+        if self.limiter is not None:
+            espera = await self.limiter.consume(_clave(scope, headers))
+            if espera:
+                metrics.UPLOAD_REJECTED.inc(reason="rate_limited")
+                respuesta = JSONResponse(
+                    status_code=429,
+                    content={"detail": "Too many uploads, please retry later"},
+                    headers={"Retry-After": str(math.ceil(espera))},
+                )
+                await respuesta(scope, receive, send)
+                return
+
+        if self.max_bytes:
+            longitud = headers.get("content-length", "")
+            if longitud.isdigit() and int(longitud) > self.max_bytes:
+                metrics.UPLOAD_REJECTED.inc(reason="too_large")
+                respuesta = JSONResponse(status_code=413, content={"detail": _demasiado_grande(self.max_bytes)})
+                await respuesta(scope, receive, send)
+                return
+            # Sin Content-Length (o si miente) se corta al recibir el byte que sobra
+            receive = self._limitar(receive)
+
+        await self.app(scope, receive, send)
+
+    def _limitar(self, receive):
+        recibidos = 0
+
+        async def receive_limitado():
+            nonlocal recibidos
+            mensaje = await receive()
+            if mensaje["type"] == "http.request":
+                recibidos += len(mensaje.get("body", b""))
+                if recibidos > self.max_bytes:
+                    metrics.UPLOAD_REJECTED.inc(reason="too_large")
+                    raise UploadTooLarge(_demasiado_grande(self.max_bytes))
+            return mensaje
+
+        return receive_limitado
+
+
+def _demasiado_grande(max_bytes):
+    return f"The upload exceeds the maximum size of {max_bytes} bytes"
+
+
+def get_limiter():
+    """Limitador de subidas según la configuración, o None si está desactivado"""
+    if UPLOAD_RATE_PER_MINUTE <= 0:
+        return None
+    return RateLimiter(UPLOAD_RATE_PER_MINUTE, UPLOAD_RATE_BURST)
+
+
+def check_file_count(num_ficheros):
+    if UPLOAD_MAX_FILES and num_ficheros > UPLOAD_MAX_FILES:
+        metrics.UPLOAD_REJECTED.inc(reason="too_many_files")
+        raise UploadTooLarge(f"Too many files in one upload (maximum {UPLOAD_MAX_FILES})")
+
+
+def check_csv_rows(filas):
+    if UPLOAD_MAX_CSV_ROWS and filas > UPLOAD_MAX_CSV_ROWS:
+        metrics.UPLOAD_REJECTED.inc(reason="too_many_rows")
+        raise UploadTooLarge(f"The CSV has too many rows (maximum {UPLOAD_MAX_CSV_ROWS})")
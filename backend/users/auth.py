@@ -4,19 +4,18 @@ from fastapi import Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 from . import schemas
 from .db import get_db
-from jose import JWTError, jwt
 
 # Asynchronous function for user authentication
 async def authenticate_user(db: AsyncSession, username: str, password: str):
     result = await db.execute(select(models.User).filter(models.User.name == username))
     user = result.scalars().first()
-    if not user or not security.verify_password(password, user.hashed_password):
+    if not user or not await security.verify_password_async(password, user.hashed_password):
         return False
     return user
 
 # Asynchronous function for user creation
 async def create_user(db: AsyncSession, user: schemas.UserCreate):
-    hashed_password = security.hash_password(user.password)
+    hashed_password = await security.hash_password_async(user.password)
     db_user = models.User(name=user.name, email=user.email, hashed_password=hashed_password)
     db.add(db_user)
     await db.commit()
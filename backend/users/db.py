@@ -1,35 +1,82 @@
+import logging
 import os
-from dotenv import load_dotenv
 
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
 
-# Load environment variables from .env file
-load_dotenv()
+logger = logging.getLogger(__name__)
 
-# Retrieve database configuration from environment variables
-user = os.getenv("DB_USER", "default_user")
-password = os.getenv("DB_PASSWORD", "default_password")
-host = os.getenv("DB_HOST", "localhost")
-database = os.getenv("DB_NAME", "default_db_name")
+# Build the database URL from the environment.
+# DATABASE_URL wins; otherwise PostgreSQL is used when any DB_* setting is present,
+# and a local SQLite file (aiosqlite) when none is, for local runs.
+def get_database_url():
+    if os.getenv("DATABASE_URL"):
+        return os.getenv("DATABASE_URL")
+    if any(os.getenv(var) for var in ("DB_USER", "DB_PASSWORD", "DB_HOST", "DB_NAME")):
+        user = os.getenv("DB_USER", "default_user")
+        password = os.getenv("DB_PASSWORD", "default_password")
+        host = os.getenv("DB_HOST", "localhost")
+        database = os.getenv("DB_NAME", "default_db_name")
+        return f"postgresql+asyncpg://{user}:{password}@{host}/{database}"
+    return f"sqlite+aiosqlite:///{os.getenv('DB_SQLITE_PATH', 'mercadona.sqlite3')}"
 
-DATABASE_URL = f"postgresql+asyncpg://{user}:{password}@{host}/{database}"
-print(DATABASE_URL)
-# Create the engine
-engine = create_async_engine(DATABASE_URL, echo=True)
+def _env_bool(name: str, default: str):
+    return os.getenv(name, default).lower() in ("1", "true", "yes")
 
-# Create a configured "Session" class
+# Create the engine with explicit pool limits taken from the environment
+def create_engine_from_env(url: str = None):
+    url = make_url(url or get_database_url())
+    options = {"echo": _env_bool("DB_ECHO", "false")}
+
+    if url.get_backend_name() != "sqlite":
+        options.update(
+            pool_size=int(os.getenv("DB_POOL_SIZE", "5")),
+            max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "10")),
+            pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", "30")),
+            pool_recycle=int(os.getenv("DB_POOL_RECYCLE", "1800")),
+            pool_pre_ping=_env_bool("DB_POOL_PRE_PING", "true"),
+        )
+    if url.get_driver_name() == "asyncpg":
+        # Cache of prepared statements per connection, kept by SQLAlchemy's asyncpg dialect
+        options["connect_args"] = {"prepared_statement_cache_size": int(os.getenv("DB_STATEMENT_CACHE_SIZE", "500"))}
+
+    logger.info("Database: %s", url.render_as_string(hide_password=True))
+    return create_async_engine(url, **options)
+
+# The engine is created by init_engine() when the application starts (see the lifespan
+# hook in main.py), not on import, so importing the app does not touch the driver or the
+# database and the URL can come from settings loaded after import.
+engine = None
+
+# Create a configured "Session" class; it is bound to the engine by init_engine()
 async_session = sessionmaker(
     autocommit=False,
     autoflush=False,
-    bind=engine,
-    class_=AsyncSession
+    class_=AsyncSession,
+    expire_on_commit=False,  # Objects stay usable after commit without lazy loads on the event loop
 )
 
+# Create the engine (once) and bind the session factory to it
+def init_engine(url: str = None):
+    global engine
+    if engine is None:
+        engine = create_engine_from_env(url)
+        async_session.configure(bind=engine)
+    return engine
+
+# Close the pooled connections and forget the engine (on shutdown)
+async def dispose_engine():
+    global engine
+    if engine is not None:
+        await engine.dispose()
+        engine = None
+        async_session.configure(bind=None)
+
 # Create a base class for declarative models
 Base = declarative_base()
 
 # Dependency to get the session
 async def get_db():
     async with async_session() as session:
-        yield session
\ No newline at end of file
+        yield session
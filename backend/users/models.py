@@ -1,5 +1,6 @@
-from sqlalchemy import Column, Integer, String
+from sqlalchemy import Column, Date, Float, ForeignKey, Index, Integer, String, Text
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.schema import CreateIndex
 
 Base = declarative_base()
 
@@ -9,4 +10,96 @@ class User(Base):
     
     name = Column(String, primary_key=True, unique=True, index=True)
     email = Column(String, unique=False, index=True)
-    hashed_password = Column(String)
\ No newline at end of file
+    hashed_password = Column(String)
+
+class TicketLine(Base):
+    """Model for a product line of an uploaded ticket"""
+    __tablename__ = "TicketLine"
+    __table_args__ = (
+        Index("ix_TicketLine_user_fecha_clasificacion", "user_name", "fecha", "clasificacion"),
+        Index("ix_TicketLine_user_fuente", "user_name", "fuente"),  # Removing a partial CSV upload
+        # Distinct descriptions in order and their reclassification (reclassification jobs)
+        Index("ix_TicketLine_user_descripcion", "user_name", "descripcion"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_name = Column(String, ForeignKey("User.name", ondelete="CASCADE"), nullable=False)
+    fuente = Column(String(64), nullable=False)  # SHA-256 of the uploaded PDF/CSV the line comes from
+    num_articulos = Column(Integer)
+    descripcion = Column(String)
+    p_unit = Column(Float)
+    importe = Column(Float, nullable=False)
+    fecha = Column(Date)
+    hora = Column(String)
+    clasificacion = Column(String, nullable=False)
+
+
+class IngestedSource(Base):
+    """Uploaded file already stored for a user; the primary key makes concurrent re-uploads skip it"""
+    __tablename__ = "IngestedSource"
+
+    user_name = Column(String, ForeignKey("User.name", ondelete="CASCADE"), primary_key=True)
+    fuente = Column(String(64), primary_key=True)  # SHA-256 of the uploaded PDF/CSV
+
+
+class DailySpend(Base):
+    """Running total spent by a user per day"""
+    __tablename__ = "DailySpend"
+
+    user_name = Column(String, ForeignKey("User.name", ondelete="CASCADE"), primary_key=True)
+    fecha = Column(Date, primary_key=True)
+    importe = Column(Float, nullable=False, default=0)
+
+
+class DailyCategorySpend(Base):
+    """Running total spent by a user per day and category"""
+    __tablename__ = "DailyCategorySpend"
+
+    user_name = Column(String, ForeignKey("User.name", ondelete="CASCADE"), primary_key=True)
+    fecha = Column(Date, primary_key=True)
+    clasificacion = Column(String, primary_key=True)
+    importe = Column(Float, nullable=False, default=0)
+
+
+class MonthlyCategorySpend(Base):
+    """Running total spent by a user per month and category"""
+    __tablename__ = "MonthlyCategorySpend"
+
+    user_name = Column(String, ForeignKey("User.name", ondelete="CASCADE"), primary_key=True)
+    mes = Column(Date, primary_key=True)  # First day of the month
+    clasificacion = Column(String, primary_key=True)
+    importe = Column(Float, nullable=False, default=0)
+
+
+class CategorySpend(Base):
+    """Running total spent by a user per category"""
+    __tablename__ = "CategorySpend"
+
+    user_name = Column(String, ForeignKey("User.name", ondelete="CASCADE"), primary_key=True)
+    clasificacion = Column(String, primary_key=True)
+    importe = Column(Float, nullable=False, default=0)
+
+
+class ClassificationRuleSet(Base):
+    """Classification keywords of a user, versioned so concurrent edits cannot overwrite each other"""
+    __tablename__ = "ClassificationRuleSet"
+
+    user_name = Column(String, ForeignKey("User.name", ondelete="CASCADE"), primary_key=True)
+    version = Column(Integer, nullable=False)  # Increases by one on every change
+    clasificaciones = Column(Text, nullable=False)  # JSON object {category: [keywords]}, in priority order
+
+
+class AppSetting(Base):
+    """Application-wide values that must survive restarts (e.g. the classifier algorithm version last applied)"""
+    __tablename__ = "AppSetting"
+
+    clave = Column(String(64), primary_key=True)
+    valor = Column(Text, nullable=False)
+
+
+# create_all does not add new indexes to tables that already exist: create the missing ones
+# (IF NOT EXISTS, so several workers starting at once do not fail)
+def create_missing_indexes(conn):
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            conn.execute(CreateIndex(index, if_not_exists=True))
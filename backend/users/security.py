@@ -1,15 +1,48 @@
-from passlib.context import CryptContext
-from jose import JWTError, jwt
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Password hashing. passlib and bcrypt are loaded with the first hash, not on import.
+@lru_cache(maxsize=None)
+def get_pwd_context():
+    from passlib.context import CryptContext
+    return CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 def hash_password(password: str):
-    return pwd_context.hash(password)
+    return get_pwd_context().hash(password)
 
 def verify_password(plain_password: str, hashed_password: str):
-    return pwd_context.verify(plain_password, hashed_password)
+    return get_pwd_context().verify(plain_password, hashed_password)
+
+# bcrypt runs on a dedicated, bounded thread pool so it never blocks the event loop.
+# At most PASSWORD_HASH_QUEUE operations may be running or waiting; beyond that new
+# ones are rejected instead of piling up behind a login storm.
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", "32"))
+
+_hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+_hash_pending = 0
+
+class PasswordHasherBusy(Exception):
+    """Raised when too many password hashing operations are already queued"""
+
+async def _run_hasher(func, *args):
+    global _hash_pending
+    if _hash_pending >= PASSWORD_HASH_QUEUE:
+        raise PasswordHasherBusy()
+    _hash_pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_hash_executor, func, *args)
+    finally:
+        _hash_pending -= 1
+
+async def hash_password_async(password: str):
+    return await _run_hasher(hash_password, password)
+
+async def verify_password_async(plain_password: str, hashed_password: str):
+    return await _run_hasher(verify_password, plain_password, hashed_password)
 
 # JWT Token management
 SECRET_KEY = "your_secret_key"
@@ -17,7 +50,16 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
 def create_access_token(data: dict):
+    from jose import jwt
     to_encode = data.copy()
     expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     to_encode.update({"exp": expire})
-    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
\ No newline at end of file
+    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+
+# Payload of a valid token, or None if the token is invalid or expired
+def decode_access_token(token: str):
+    from jose import JWTError, jwt
+    try:
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
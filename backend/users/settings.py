@@ -0,0 +1,33 @@
+from sqlalchemy import insert, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.future import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models
+
+# Asynchronous function to read an application setting (None if it was never stored)
+async def get_setting(db: AsyncSession, clave: str):
+    result = await db.execute(select(models.AppSetting.valor).filter(models.AppSetting.clave == clave))
+    return result.scalar()
+
+# Asynchronous function to change a setting only if it still has the value `anterior` (None:
+# not stored yet). Returns False if another process changed it first. It must be the first
+# write of the transaction, and the caller commits: with several workers starting at once,
+# the others wait for that commit and then see the setting already changed, so whatever the
+# winner does in the same transaction (e.g. a one-time rebuild) runs only once.
+async def compare_and_set_setting(db: AsyncSession, clave: str, anterior, valor: str):
+    try:
+        if anterior is None:
+            await db.execute(insert(models.AppSetting).values(clave=clave, valor=valor))
+            return True
+        result = await db.execute(
+            update(models.AppSetting)
+            .where(models.AppSetting.clave == clave, models.AppSetting.valor == anterior)
+            .values(valor=valor)
+        )
+    except IntegrityError:
+        await db.rollback()  # Another process stored the setting first
+        return False
+    if result.rowcount == 0:
+        await db.rollback()
+        return False
+    return True
@@ -0,0 +1,123 @@
+from sqlalchemy import delete, func, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.future import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models, settings
+
+# Totals below half a cent are leftovers of subtracting floats and are removed
+EPSILON = 0.005
+
+# Aggregate tables and the columns that identify each of their rows
+AGREGADOS = (
+    (models.DailySpend, ["user_name", "fecha"]),
+    (models.DailyCategorySpend, ["user_name", "fecha", "clasificacion"]),
+    (models.MonthlyCategorySpend, ["user_name", "mes", "clasificacion"]),
+    (models.CategorySpend, ["user_name", "clasificacion"]),
+)
+
+# Build an "add to the running total" upsert for the database in use
+def _upsert(db: AsyncSession, model, claves):
+    dialect = db.get_bind().dialect.name
+    insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+    stmt = insert(model)
+    return stmt.on_conflict_do_update(index_elements=claves, set_={"importe": model.importe + stmt.excluded.importe})
+
+# Group ticket lines (user_name, fecha, clasificacion, importe) into deltas for each aggregate table
+def _deltas(lineas: "pd.DataFrame", signo: int):
+    import pandas as pd
+    lineas = lineas.assign(importe=lineas["importe"] * signo)
+    fechas = pd.to_datetime(lineas["fecha"])
+    con_fecha = lineas[fechas.notna()].assign(mes=fechas.dt.to_period("M").dt.start_time.dt.date)
+    return {
+        models.DailySpend: con_fecha.groupby(["user_name", "fecha"], as_index=False)["importe"].sum(),
+        models.DailyCategorySpend: con_fecha.groupby(["user_name", "fecha", "clasificacion"], as_index=False)["importe"].sum(),
+        models.MonthlyCategorySpend: con_fecha.groupby(["user_name", "mes", "clasificacion"], as_index=False)["importe"].sum(),
+        models.CategorySpend: lineas.groupby(["user_name", "clasificacion"], as_index=False)["importe"].sum(),
+    }
+
+# Asynchronous function to add (signo=1) or subtract (signo=-1) ticket lines from the aggregates.
+# Only the rows touched by the lines are written, so the cost depends on the new data, not the history.
+# The caller commits.
+async def apply_spend_deltas(db: AsyncSession, lineas: "pd.DataFrame", signo: int = 1):
+    if lineas.empty:
+        return
+    deltas = _deltas(lineas, signo)
+    for model, claves in AGREGADOS:
+        rows = deltas[model].to_dict(orient="records")
+        if rows:
+            await db.execute(_upsert(db, model, claves), rows)
+        if signo < 0:
+            usuarios = lineas["user_name"].unique().tolist()
+            await db.execute(delete(model).where(model.user_name.in_(usuarios), func.abs(model.importe) < EPSILON))
+
+# Asynchronous function to recompute the aggregates of every user from the stored ticket lines
+async def rebuild_spend_aggregates(db: AsyncSession):
+    import pandas as pd
+    for model, _ in AGREGADOS:
+        await db.execute(delete(model))
+    result = await db.execute(select(
+        models.TicketLine.user_name, models.TicketLine.fecha, models.TicketLine.clasificacion,
+        func.sum(models.TicketLine.importe).label("importe"),
+    ).group_by(models.TicketLine.user_name, models.TicketLine.fecha, models.TicketLine.clasificacion))
+    lineas = pd.DataFrame(result.all(), columns=["user_name", "fecha", "clasificacion", "importe"])
+    await apply_spend_deltas(db, lineas)
+    await db.commit()
+
+# AppSetting that records which aggregate tables were last built from the stored lines
+CLAVE_AGREGADOS = "spend_aggregates"
+
+# Asynchronous function to rebuild the aggregates once when the set of aggregate tables changes
+# (e.g. an aggregate table was just created on a database that already had tickets). Only the
+# worker that updates the marker rebuilds, in the same transaction, so several workers starting
+# at once cannot rebuild twice.
+async def ensure_spend_aggregates(db: AsyncSession):
+    tablas = ",".join(model.__tablename__ for model, _ in AGREGADOS)
+    anterior = await settings.get_setting(db, CLAVE_AGREGADOS)
+    if anterior == tablas:
+        return
+    if await settings.compare_and_set_setting(db, CLAVE_AGREGADOS, anterior, tablas):
+        await rebuild_spend_aggregates(db)
+
+# Asynchronous function to move the lines of a user to new categories after a rule change.
+# `nuevas` maps each description to its new category. Only lines whose category changes
+# are touched, and the aggregates are moved from the old category to the new one instead
+# of being recomputed. The amounts moved are the ones the UPDATE returns, so lines inserted
+# or reclassified by someone else meanwhile are never counted twice or missed.
+# Returns the number of lines moved.
+async def reclassify_lines(db: AsyncSession, user_name: str, nuevas: dict):
+    if not nuevas:
+        return 0
+    import pandas as pd
+    result = await db.execute(select(
+        models.TicketLine.descripcion, models.TicketLine.clasificacion,
+    ).filter(
+        models.TicketLine.user_name == user_name,
+        models.TicketLine.descripcion.in_(list(nuevas)),
+    ).distinct())
+    # One UPDATE per (old category, new category) pair with all of its descriptions
+    cambios = {}
+    for descripcion, clasificacion in result.all():
+        if nuevas[descripcion] != clasificacion:
+            cambios.setdefault((clasificacion, nuevas[descripcion]), []).append(descripcion)
+    if not cambios:
+        return 0
+
+    tabla = models.TicketLine.__table__
+    movidas = []
+    for (anterior, nueva), descripciones in cambios.items():
+        result = await db.execute(
+            update(tabla)
+            .where(
+                tabla.c.user_name == user_name,
+                tabla.c.clasificacion == anterior,
+                tabla.c.descripcion.in_(descripciones),
+            )
+            .values(clasificacion=nueva)
+            .returning(tabla.c.fecha, tabla.c.importe)
+        )
+        movidas.extend((user_name, fecha, anterior, nueva, importe) for fecha, importe in result.all())
+    lineas = pd.DataFrame(movidas, columns=["user_name", "fecha", "clasificacion", "nueva", "importe"])
+    await apply_spend_deltas(db, lineas, signo=-1)
+    await apply_spend_deltas(db, lineas.assign(clasificacion=lineas["nueva"]))
+    await db.commit()
+    return len(lineas)
@@ -0,0 +1,181 @@
+from sqlalchemy import delete, distinct, func, insert, true
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.future import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models, settings, spend
+
+# Columns of the processed DataFrames and their TicketLine counterparts
+COLUMNAS = {
+    "Número de artículos": "num_articulos",
+    "Descripción": "descripcion",
+    "P. Unit": "p_unit",
+    "Importe": "importe",
+    "Fecha": "fecha",
+    "Hora": "hora",
+    "Clasificación": "clasificacion",
+}
+
+# Convert a processed DataFrame into TicketLine rows ready for a bulk insert
+def dataframe_to_rows(user_name: str, fuente: str, df: "pd.DataFrame"):
+    import pandas as pd
+    lineas = df.reindex(columns=list(COLUMNAS)).rename(columns=COLUMNAS)
+    lineas["fecha"] = pd.to_datetime(lineas["fecha"], format="%d/%m/%Y", errors="coerce").dt.date
+    lineas["clasificacion"] = lineas["clasificacion"].astype(str)
+    lineas = lineas.dropna(subset=["importe"])
+    lineas = lineas.astype(object).where(lineas.notna(), None)
+    lineas["user_name"] = user_name
+    lineas["fuente"] = fuente
+    return lineas.to_dict(orient="records")
+
+# Asynchronous function to find which uploaded files were already ingested by a user
+async def get_ingested_sources(db: AsyncSession, user_name: str, fuentes: list):
+    result = await db.execute(
+        select(models.IngestedSource.fuente)
+        .filter(models.IngestedSource.user_name == user_name, models.IngestedSource.fuente.in_(fuentes))
+    )
+    return set(result.scalars().all())
+
+# Asynchronous function to list the users that have stored ticket lines
+async def get_users_with_tickets(db: AsyncSession):
+    result = await db.execute(select(models.IngestedSource.user_name).distinct())
+    return result.scalars().all()
+
+# Asynchronous function to register uploaded files as ingested by a user. Returns the ones
+# registered now; those already registered (also by a concurrent upload, thanks to the
+# primary key) are left out. The caller commits, together with the lines of the files.
+async def claim_sources(db: AsyncSession, user_name: str, fuentes: list):
+    fuentes = list(dict.fromkeys(fuentes))
+    if not fuentes:
+        return set()
+    insert_dialecto = postgresql.insert if db.get_bind().dialect.name == "postgresql" else sqlite.insert
+    result = await db.execute(
+        insert_dialecto(models.IngestedSource)
+        .values([{"user_name": user_name, "fuente": fuente} for fuente in fuentes])
+        .on_conflict_do_nothing()
+        .returning(models.IngestedSource.fuente)
+    )
+    return set(result.scalars().all())
+
+# AppSetting set once the sources of the lines stored before IngestedSource existed are registered
+CLAVE_FUENTES = "ingested_sources_backfilled"
+
+# Asynchronous function to register the sources of the lines stored before the IngestedSource
+# table existed (e.g. on a database that already had tickets). It runs once: only the worker
+# that sets the marker copies them, and sources already claimed by new uploads are skipped.
+async def ensure_ingested_sources(db: AsyncSession):
+    if await settings.get_setting(db, CLAVE_FUENTES) is not None:
+        return
+    if not await settings.compare_and_set_setting(db, CLAVE_FUENTES, None, "1"):
+        return
+    insert_dialecto = postgresql.insert if db.get_bind().dialect.name == "postgresql" else sqlite.insert
+    await db.execute(
+        insert_dialecto(models.IngestedSource).from_select(
+            ["user_name", "fuente"],
+            # WHERE true: SQLite needs it to parse ON CONFLICT after a SELECT
+            select(models.TicketLine.user_name, models.TicketLine.fuente).where(true()).distinct(),
+        ).on_conflict_do_nothing()
+    )
+    await db.commit()
+
+# Asynchronous function to count the distinct descriptions stored for a user
+async def count_descriptions(db: AsyncSession, user_name: str):
+    result = await db.execute(
+        select(func.count(distinct(models.TicketLine.descripcion)))
+        .filter(models.TicketLine.user_name == user_name)
+    )
+    return result.scalar() or 0
+
+# Asynchronous function to page through the distinct descriptions of a user in order,
+# starting after `despues` (keyset pagination, so every page costs the same)
+async def get_descriptions_page(db: AsyncSession, user_name: str, despues: str, limite: int):
+    result = await db.execute(
+        select(models.TicketLine.descripcion)
+        .filter(models.TicketLine.user_name == user_name, models.TicketLine.descripcion > despues)
+        .distinct()
+        .order_by(models.TicketLine.descripcion)
+        .limit(limite)
+    )
+    return result.scalars().all()
+
+# Asynchronous function to store the lines of newly uploaded files with one bulk insert
+# and add them to the spending aggregates. Files the user had already uploaded are
+# skipped so re-uploads do not double count: each file is registered in IngestedSource in
+# the same transaction as its lines. Files in `reclamadas` were already registered by the
+# caller (e.g. the previous chunks of a CSV) and their lines are always added.
+async def add_ticket_lines(db: AsyncSession, user_name: str, tickets: list, reclamadas=frozenset()):
+    nuevas = await claim_sources(db, user_name, [fuente for fuente, _ in tickets if fuente not in reclamadas])
+    rows = []
+    for fuente, df in tickets:
+        if fuente in reclamadas or fuente in nuevas:
+            nuevas.discard(fuente)  # The same file twice in one upload counts once
+            rows.extend(dataframe_to_rows(user_name, fuente, df))
+    if rows:
+        import pandas as pd
+        # Core insert on the table: the ORM bulk insert would split the rows into one
+        # statement per run of rows with the same NULL columns (e.g. a missing P. Unit)
+        await db.execute(insert(models.TicketLine.__table__), rows)
+        await spend.apply_spend_deltas(db, pd.DataFrame(rows, columns=["user_name", "fecha", "clasificacion", "importe"]))
+    await db.commit()
+    return len(rows)
+
+# Asynchronous function to forget an uploaded file of a user: its lines are deleted and
+# subtracted from the aggregates, and it is no longer registered as ingested, all in one
+# transaction (e.g. when a background job fails after storing part of a CSV)
+async def remove_source(db: AsyncSession, user_name: str, fuente: str):
+    import pandas as pd
+    tabla = models.TicketLine.__table__
+    result = await db.execute(
+        delete(tabla)
+        .where(tabla.c.user_name == user_name, tabla.c.fuente == fuente)
+        .returning(tabla.c.user_name, tabla.c.fecha, tabla.c.clasificacion, tabla.c.importe)
+    )
+    borradas = pd.DataFrame(result.all(), columns=["user_name", "fecha", "clasificacion", "importe"])
+    await spend.apply_spend_deltas(db, borradas, signo=-1)
+    await db.execute(delete(models.IngestedSource).where(
+        models.IngestedSource.user_name == user_name, models.IngestedSource.fuente == fuente))
+    await db.commit()
+    return len(borradas)
+
+# Asynchronous function to get the spending time series of a user
+async def get_serie_temporal(db: AsyncSession, user_name: str):
+    result = await db.execute(
+        select(models.DailySpend.fecha, models.DailySpend.importe)
+        .filter(models.DailySpend.user_name == user_name)
+        .order_by(models.DailySpend.fecha)
+    )
+    return [{"Fecha": fecha.strftime("%d/%m/%Y"), "Importe": importe} for fecha, importe in result.all()]
+
+# Asynchronous function to get the daily spending per category of a user,
+# optionally between two dates (both included)
+async def get_gasto_diario_categoria(db: AsyncSession, user_name: str, desde=None, hasta=None):
+    consulta = (
+        select(models.DailyCategorySpend.fecha, models.DailyCategorySpend.clasificacion, models.DailyCategorySpend.importe)
+        .filter(models.DailyCategorySpend.user_name == user_name)
+    )
+    if desde is not None:
+        consulta = consulta.filter(models.DailyCategorySpend.fecha >= desde)
+    if hasta is not None:
+        consulta = consulta.filter(models.DailyCategorySpend.fecha <= hasta)
+    result = await db.execute(consulta)
+    return result.all()
+
+# Asynchronous function to get the spending per category of a user
+async def get_gasto_categoria(db: AsyncSession, user_name: str):
+    result = await db.execute(
+        select(models.CategorySpend.clasificacion, models.CategorySpend.importe)
+        .filter(models.CategorySpend.user_name == user_name)
+        .order_by(models.CategorySpend.clasificacion)
+    )
+    return [{"Clasificación": clasificacion, "Importe": importe} for clasificacion, importe in result.all()]
+
+# Asynchronous function to get the monthly spending per category of a user
+async def get_gasto_mensual(db: AsyncSession, user_name: str):
+    result = await db.execute(
+        select(models.MonthlyCategorySpend.mes, models.MonthlyCategorySpend.clasificacion, models.MonthlyCategorySpend.importe)
+        .filter(models.MonthlyCategorySpend.user_name == user_name)
+        .order_by(models.MonthlyCategorySpend.mes, models.MonthlyCategorySpend.clasificacion)
+    )
+    return [
+        {"Mes": mes.strftime("%m/%Y"), "Clasificación": clasificacion, "Importe": importe}
+        for mes, clasificacion, importe in result.all()
+    ]
@@ -0,0 +1,65 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Seconds a verified token is trusted without checking the database again
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "60"))
+# Maximum number of cached tokens (0 disables the cache)
+AUTH_CACHE_MAX = int(os.getenv("AUTH_CACHE_MAX", "10000"))
+
+
+class TokenCache:
+    """In-process LRU cache of verified token -> user, with a short TTL"""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._tokens = OrderedDict()
+
+    def get(self, token: str):
+        with self._lock:
+            entrada = self._tokens.get(token)
+            if entrada is not None and entrada[1] > time.time():
+                self._tokens.move_to_end(token)
+                self.hits += 1
+                return entrada[0]
+            if entrada is not None:
+                del self._tokens[token]
+            self.misses += 1
+            return None
+
+    # The entry never outlives the token itself
+    def put(self, token: str, user, exp=None):
+        if self.max_entries <= 0:
+            return
+        caduca = time.time() + self.ttl
+        if exp is not None:
+            caduca = min(caduca, float(exp))
+        with self._lock:
+            self._tokens[token] = (user, caduca)
+            self._tokens.move_to_end(token)
+            while len(self._tokens) > self.max_entries:
+                self._tokens.popitem(last=False)
+
+    # Forget every token of a user (call it whenever the user changes)
+    def invalidate_user(self, name: str):
+        with self._lock:
+            for token in [t for t, (user, _) in self._tokens.items() if user.name == name]:
+                del self._tokens[token]
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._tokens),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+token_cache = TokenCache(AUTH_CACHE_MAX, AUTH_CACHE_TTL)